@@ -27,10 +27,13 @@ app_config_path = os.getenv("APP_CONFIG_PATH", "simulation_lambda")
 full_config_path = "/" + app_config_path
 # Initialize app at global scope for reuse across invocations
 app = None
+# Modules imported by the simulation app, zipped next to it by scripts/build.sh
+SIMULATION_MODULES = "simulator_modules.zip"
 
 
 class SimulationLauncher:
     simulation_app: str
+    simulation_modules: str
     log_path: str
     bootstrap_script_path: str
     instance_type: str
@@ -62,6 +65,8 @@ class SimulationLauncher:
             print("Encountered an error loading config from SSM.")
             traceback.print_exc()
         self.simulation_app = config_dict["simulation_app"]
+        self.simulation_modules = (self.simulation_app.rsplit("/", 1)[0] +
+                                   "/" + SIMULATION_MODULES)
         self.log_path = config_dict["log_path"]
         self.bootstrap_script_path = config_dict["bootstrap_script_path"]
         self.instance_type = config_dict["instance_type"]
@@ -200,6 +205,8 @@ def create_emr(simulation_id: str, user_id: str) -> Dict[str, str]:
                         "cluster",
                         "--master",
                         "yarn",
+                        "--py-files",
+                        app.simulation_modules,
                         app.simulation_app,
                     ],
                 },
@@ -14,4 +14,6 @@ popd
 #Simulation App
 pushd simulator
 echo "Build Step for Simulator"
+# Modules imported by the spark app, shipped to the cluster with --py-files
+zip simulator_modules.zip contacts.py elastic.py population.py rng.py stats.py
 popd
\ No newline at end of file
@@ -0,0 +1,102 @@
+import numpy as np
+
+
+def cell_index(x, y, dist_limit, x_limit, y_limit):
+    """
+    Bucket points into the cells of a uniform grid wrapped around the world
+
+    Cells are at least dist_limit wide, so everybody within dist_limit of a
+    person lives in the same or one of the 8 surrounding cells.
+
+    Keyword arguments:
+    x, y -- coordinate arrays
+    dist_limit -- safe social distance limit
+    x_limit -- max range on X-axis
+    y_limit -- max range on Y-axis
+    """
+
+    assert dist_limit > 0
+
+    nx = max(1, int(x_limit // dist_limit))
+    ny = max(1, int(y_limit // dist_limit))
+    cx = (x // (x_limit / nx)).astype(np.int64) % nx
+    cy = (y // (y_limit / ny)).astype(np.int64) % ny
+    return cx, cy, nx, ny
+
+
+def contact_pairs(x,
+                  y,
+                  dist_limit,
+                  x_limit,
+                  y_limit,
+                  sources=None,
+                  targets=None,
+                  groups=None,
+                  chunk_size=65536):
+    """
+    Find every (source, target) pair of people closer than dist_limit
+
+    Targets are sorted by grid cell and every source only looks at the
+    targets in its 3x3 cell neighbourhood, so the cost grows with N times
+    the local density instead of N^2. The neighbourhood wraps at the edges
+    of the world like random_walk does; distances are the plain euclidean
+    ones used by check.
+
+    Keyword arguments:
+    x, y -- coordinate arrays of the population
+    dist_limit -- safe social distance limit
+    x_limit -- max range on X-axis
+    y_limit -- max range on Y-axis
+    sources -- boolean mask of the people to search from (default: everybody)
+    targets -- boolean mask of the people to search for (default: everybody)
+    groups -- group of every person, only people of a group meet each other
+    chunk_size -- number of sources expanded at once, bounds memory use
+    """
+
+    N = len(x)
+    src = np.arange(N) if sources is None else np.flatnonzero(sources)
+    tgt = np.arange(N) if targets is None else np.flatnonzero(targets)
+    if len(src) == 0 or len(tgt) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    cx, cy, nx, ny = cell_index(x, y, dist_limit, x_limit, y_limit)
+
+    # Every group gets its own copy of the grid
+    base = np.zeros(N, dtype=np.int64) if groups is None else groups * nx
+
+    # Sort the targets by cell so every cell is a contiguous slice
+    tkey = (base[tgt] + cx[tgt]) * ny + cy[tgt]
+    order = np.argsort(tkey, kind='stable')
+    tkey, tgt = tkey[order], tgt[order]
+
+    # Distinct neighbour offsets, small grids wrap onto the same cells
+    x_offsets = sorted({o % nx for o in (-1, 0, 1)})
+    y_offsets = sorted({o % ny for o in (-1, 0, 1)})
+
+    pairs_s, pairs_t = [], []
+    for begin in range(0, len(src), chunk_size):
+        s_chunk = src[begin:begin + chunk_size]
+        sbase, scx, scy = base[s_chunk], cx[s_chunk], cy[s_chunk]
+        for ox in x_offsets:
+            for oy in y_offsets:
+                nkey = (sbase + (scx + ox) % nx) * ny + (scy + oy) % ny
+                lo = np.searchsorted(tkey, nkey, side='left')
+                hi = np.searchsorted(tkey, nkey, side='right')
+                count = hi - lo
+                total = int(count.sum())
+                if total == 0:
+                    continue
+
+                # Expand every source against the targets of the cell
+                s = np.repeat(s_chunk, count)
+                first = np.repeat(np.cumsum(count) - count, count)
+                t = tgt[np.repeat(lo, count) + np.arange(total) - first]
+
+                dist = np.sqrt((x[s] - x[t])**2 + (y[s] - y[t])**2)
+                close = (dist < dist_limit) & (s != t)
+                pairs_s.append(s[close])
+                pairs_t.append(t[close])
+
+    if not pairs_s:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(pairs_s), np.concatenate(pairs_t)
@@ -1,98 +1,221 @@
+import atexit
+import os
+import queue
+import threading
 import time
 
 import boto3
+import numpy as np
 import pandas as pd
 from elasticsearch import Elasticsearch
 from elasticsearch import helpers
 
+# Labels of the states in the dashboards
+LEGEND = {
+    0: 'Healthy',
+    1: 'Infected',
+    666: 'Dead',
+    115: 'Hospitalized',
+    7: 'Cured'
+}
+
 
 def ssm_param(ssm_client, param: str) -> str:
-    response = ssm_client.get_parameter(Name=f"/spark_simulation_app/{param}", WithDecryption=True)
+    response = ssm_client.get_parameter(Name=f"/spark_simulation_app/{param}",
+                                        WithDecryption=True)
     return response['Parameter']['Value']
 
 
+def bulk_load(es, actions, chunk_size, max_chunk_bytes, thread_count):
+    """
+    Stream bulk actions to Elasticsearch in chunks
+    Returns the number of documents indexed.
+    Keyword arguments:
+    es -- Elasticsearch client
+    actions -- iterator over the bulk actions
+    chunk_size -- documents per bulk request
+    max_chunk_bytes -- bytes per bulk request
+    thread_count -- bulk requests in flight, 1 to stream them in order
+    """
+
+    options = dict(chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes)
+    if thread_count > 1:
+        results = helpers.parallel_bulk(es,
+                                        actions,
+                                        thread_count=thread_count,
+                                        **options)
+    else:
+        results = helpers.streaming_bulk(es, actions, **options)
+    return sum(ok for ok, _ in results)
+
+
 class Elastic:
-    ssm_client = boto3.client("ssm", region_name="us-east-1")
-    cloud_id = ssm_param(ssm_client, "cloud_id")
-    username = ssm_param(ssm_client, "username")
-    password = ssm_param(ssm_client, "password")
+    # Looked up in SSM on first use, so importing this module has no side effects
+    cloud_id = None
+    username = None
+    password = None
+
+    # Settings of the shared client, change them before the first export
+    maxsize = 10  # connections kept alive in the pool of every node
+    timeout = 30  # seconds before a request times out
+    max_retries = 3  # retries of a request failing or timing out
+
+    # Settings of the bulk indexing
+    chunk_size = 500  # documents per bulk request
+    max_chunk_bytes = 100 * 1024 * 1024  # bytes per bulk request
+    thread_count = 4  # bulk requests in flight, 1 to stream them in order
+
+    _client = None
+    _client_pid = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def options():
+        """
+        Keyword arguments of the Elasticsearch clients
+        The credentials are looked up in SSM on first use.
+        """
+
+        if Elastic.cloud_id is None:
+            ssm_client = boto3.client("ssm", region_name="us-east-1")
+            Elastic.username = ssm_param(ssm_client, "username")
+            Elastic.password = ssm_param(ssm_client, "password")
+            Elastic.cloud_id = ssm_param(ssm_client, "cloud_id")
+        return dict(cloud_id=Elastic.cloud_id,
+                    http_auth=(Elastic.username, Elastic.password),
+                    maxsize=Elastic.maxsize,
+                    timeout=Elastic.timeout,
+                    max_retries=Elastic.max_retries,
+                    retry_on_timeout=True)
+
+    @staticmethod
+    def bulk_options():
+        """Keyword arguments of bulk_load"""
+        return dict(chunk_size=Elastic.chunk_size,
+                    max_chunk_bytes=Elastic.max_chunk_bytes,
+                    thread_count=Elastic.thread_count)
+
+    @staticmethod
+    def connect():
+        """
+        Elasticsearch client with the credentials stored in SSM
+        The client is created on first use and shared by every export of the
+        process, its pool keeps the connections alive between the calls so
+        they do not pay a new TLS handshake. A forked process makes its own.
+        """
+
+        with Elastic._lock:
+            if Elastic._client is None or Elastic._client_pid != os.getpid():
+                Elastic._client = Elasticsearch(**Elastic.options())
+                Elastic._client_pid = os.getpid()
+        return Elastic._client
 
     @staticmethod
     def load_sim_data(_covid_df, _stats_df):
         """Wrapper to load simulation data"""
 
-        # make a copy so original values are not transformed
-        covid_df = _covid_df.copy()
-        stats_df = _stats_df.copy()
-
-        # transform the values in covid_df for legend
-        D = {
-            0: 'Healthy',
-            1: 'Infected',
-            666: 'Dead',
-            115: 'Hospitalized',
-            7: 'Cured'
-        }
-        for k, v in D.items():
-            covid_df.loc[covid_df['Covid-19'] == k, 'Covid-19'] = v
+        # transform the values in covid_df for legend, on a copy so original
+        # values are not transformed
+        covid_df = _covid_df.assign(
+            **{'Covid-19': _covid_df['Covid-19'].map(LEGEND)})
 
-        # transform the values in stats_df for legend and to show multicolor lines
-        temp_df = pd.DataFrame(columns=['day', 'status', 'value'])
-        eco_df = pd.DataFrame(columns=['day', 'percentage', 'type'])
-        stats_df = stats_df.drop(['simulationID', 'Work'], axis=1)
-        for i in range(len(stats_df)):
-            for col in stats_df.columns:
-                doc = {'day': i, 'status': col, 'value': stats_df.loc[i][col]}
-                temp_df = temp_df.append(doc, ignore_index=True)
-            eco_df = eco_df.append(
-                {
-                    'day': i,
-                    'percentage': _stats_df.loc[i]['Work'],
-                    'type': 'Work'
-                },
-                ignore_index=True)
-            eco_df = eco_df.append(
-                {
-                    'day': i,
-                    'percentage': 50,
-                    'type': 'Threshold'
-                },
-                ignore_index=True)
-
-        stats_df = temp_df
+        stats_df, eco_df = Elastic.stats_documents(_stats_df)
 
         Elastic.load_data(covid_df, "covid_df")
         Elastic.load_data(stats_df, "stats_df")
         Elastic.load_data(eco_df, "eco_df")
 
     @staticmethod
-    def load_data(data, index):
+    def stats_documents(stats_df):
+        """
+        Documents of the stats_df and eco_df indices
+        stats_df holds one (day, status, value) document per day and stats
+        column, eco_df the working hours of every day and the threshold, both
+        reshaped in a single pass over the stats arrays.
+        Keyword arguments:
+        stats_df -- stats dataframe [simulationID,Day,Healthy,Covid-19(+),Hospitalized,Cured,Dead,Work]
+        """
+
+        columns = stats_df.columns.drop(['simulationID', 'Work'])
+        days = stats_df['Day'].to_numpy()
 
-        es = Elasticsearch(cloud_id=Elastic.cloud_id,
-                           http_auth=(Elastic.username, Elastic.password))
+        # transform the values in stats_df for legend and to show multicolor lines
+        long_df = pd.DataFrame({
+            'day':
+            np.repeat(days, len(columns)),
+            'status':
+            np.tile(columns, len(days)),
+            'value':
+            stats_df[columns].to_numpy().reshape(-1)
+        })
+        eco_df = pd.DataFrame({
+            'day':
+            np.repeat(days, 2),
+            'percentage':
+            np.column_stack(
+                [stats_df['Work'].to_numpy(),
+                 np.full(len(days), 50)]).reshape(-1),
+            'type':
+            np.tile(['Work', 'Threshold'], len(days))
+        })
+        return long_df, eco_df
+
+    @staticmethod
+    def actions(data, index, ids):
+        """
+        Bulk actions of the rows of a dataframe
+        The actions are generated lazily, one chunk at a time, and every
+        chunk of documents is serialized with a single to_json call.
+        Keyword arguments:
+        data -- dataframe of the documents
+        index -- elasticsearch index
+        ids -- array with the document id of every row
+        """
+
+        for start in range(0, len(data), Elastic.chunk_size):
+            stop = start + Elastic.chunk_size
+            sources = data.iloc[start:stop].to_json(orient="records",
+                                                    lines=True).splitlines()
+            for _id, source in zip(ids[start:stop].tolist(), sources):
+                yield {
+                    "_index": index,
+                    "_type": "_doc",
+                    "_id": _id,
+                    "_source": source
+                }
+
+    @staticmethod
+    def load_data(data, index, ids=None):
+        """
+        Bulk insert the rows of a dataframe
+        The documents are streamed to Elasticsearch in chunks, by
+        thread_count threads in parallel.
+        Keyword arguments:
+        data -- dataframe of the documents
+        index -- elasticsearch index
+        ids -- document id of every row (default: the row numbers)
+        """
+
+        if len(data) == 0:
+            return
+        es = Elastic.connect()
 
         # to make the index if it doesn't exist
-        es.index(index, data.iloc[0].to_json(), id=0)
+        es.indices.create(index=index, ignore=400)
 
         # Bulk insert
-        actions = [{
-            "_index": index,
-            "_type": "_doc",
-            "_id": j,
-            "_source": data.loc[j].to_json()
-        } for j in range(0, len(data))]
-
+        ids = np.arange(len(data)) if ids is None else np.asarray(ids)
+        actions = Elastic.actions(data, index, ids)
         st = time.time()
-        helpers.bulk(es, actions)
+        indexed = bulk_load(es, actions, **Elastic.bulk_options())
         end = time.time()
-        print("total time to bulk insert", end - st)
+        print(f"total time to bulk insert {indexed} documents", end - st)
 
         es.indices.refresh(index=index)
 
     @staticmethod
     def delete_data(index, id_range):
-        es = Elasticsearch(cloud_id=Elastic.cloud_id,
-                           http_auth=(Elastic.username, Elastic.password))
+        es = Elastic.connect()
         # Bulk delete
         actions = [{
             "_op_type": 'delete',
@@ -106,6 +229,150 @@ class Elastic:
 
     @staticmethod
     def clear_data(index):
-        es = Elasticsearch(cloud_id=Elastic.cloud_id,
-                           http_auth=(Elastic.username, Elastic.password))
+        es = Elastic.connect()
         es.delete_by_query(index, body={"query": {"match_all": {}}})
+
+
+class DeltaExport:
+    """
+    Daily export of a simulation which only sends what changed
+
+    The first export sends the whole population, the next ones only the
+    people whose state or position changed since the previous export and
+    the stats rows which were not sent yet. Documents get stable ids built
+    from the simulation ID, the day and the pid or status, so exporting a
+    day again overwrites its documents instead of duplicating them.
+    """
+    def __init__(self, simulation_id):
+        """
+        Keyword arguments:
+        simulation_id -- simulation ID of the documents
+        """
+
+        self.simulation_id = simulation_id
+        self.sent = None  # X, Y and Covid-19 of the last export
+        self.stats_days = 0  # stats rows already sent
+
+    def export(self, day, covid_df, stats_df):
+        """
+        Send the changes since the last export
+
+        Keyword arguments:
+        day -- current day
+        covid_df -- covid dataframe [X,Y,Covid-19,Day,status,working_hours] indexed by pid
+        stats_df -- stats dataframe [simulationID,Day,Healthy,Covid-19(+),Hospitalized,Cured,Dead,Work]
+        """
+
+        current = covid_df[['X', 'Y', 'Covid-19']].to_numpy()
+        if self.sent is None:
+            changed = np.ones(len(covid_df), dtype=bool)
+        else:
+            changed = (current != self.sent).any(axis=1)
+        self.sent = current
+
+        covid_df = covid_df[changed]
+        legend = covid_df['Covid-19'].map(LEGEND)
+        covid_df = covid_df.assign(pid=covid_df.index,
+                                   simulationID=self.simulation_id,
+                                   day=day)
+        covid_df['Covid-19'] = legend
+        prefix = f"{self.simulation_id}-{day}-"
+        Elastic.load_data(covid_df, "covid_df",
+                          prefix + covid_df.index.astype(str))
+
+        # Only the days recorded since the last export
+        stats_df = stats_df.iloc[self.stats_days:]
+        self.stats_days += len(stats_df)
+        stats_df, eco_df = Elastic.stats_documents(stats_df)
+        Elastic.load_data(
+            stats_df, "stats_df", self.simulation_id + '-' +
+            stats_df['day'].astype(str) + '-' + stats_df['status'])
+        Elastic.load_data(
+            eco_df, "eco_df", self.simulation_id + '-' +
+            eco_df['day'].astype(str) + '-' + eco_df['type'])
+
+
+class AsyncExport:
+    """
+    Exports running on a background thread while the simulation goes on
+
+    Exports wait in a bounded queue and a writer thread sends them in
+    order, so day N+1 is computed while day N is uploaded. When the sink
+    falls behind the queue fills up and the simulation blocks until there
+    is room again. close sends every export still queued; it also runs
+    when the interpreter exits, so a failing simulation keeps the days it
+    already exported. An error of the writer is raised in the simulation
+    on the next export or on close.
+    """
+    def __init__(self, exporter, max_pending=2):
+        """
+        Keyword arguments:
+        exporter -- exporter with an export method, e.g. DeltaExport
+        max_pending -- exports waiting in the queue before the simulation
+                       blocks (default: 2)
+        """
+
+        self.exporter = exporter
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.closed = False
+
+        # Metrics
+        self.exports = 0  # exports queued
+        self.max_depth = 0  # most exports waiting at once
+        self.blocked = 0.0  # seconds the simulation waited for the queue
+        self.busy = 0.0  # seconds the writer spent exporting
+
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    @property
+    def depth(self):
+        """Number of exports waiting in the queue"""
+        return self.queue.qsize()
+
+    def _write(self):
+        while True:
+            function, args = self.queue.get()
+            if function is None:
+                return
+            start = time.time()
+            try:
+                if self.error is None:
+                    function(*args)
+            except Exception as error:
+                self.error = error
+            self.busy += time.time() - start
+
+    def _put(self, function, args):
+        if self.error is not None:
+            raise self.error
+        start = time.time()
+        self.queue.put((function, args))
+        self.blocked += time.time() - start
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def export(self, *args):
+        """Queue an export, the arguments of the export of the exporter"""
+
+        self._put(self.exporter.export, args)
+        self.exports += 1
+
+    def call_after(self, function):
+        """Call function on the writer once the exports queued so far are sent"""
+        self._put(function, ())
+
+    def close(self):
+        """Wait until every queued export is sent"""
+
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        self.queue.put((None, ()))
+        self.thread.join()
+        print(f"Exports: {self.exports}, max queue depth: {self.max_depth}, "
+              f"blocked: {self.blocked:.2f}s, exporting: {self.busy:.2f}s")
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,223 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+import argparse
+
+from population import Population, STATUS_TYPE
+from stats import StatsBuffer, STATS_COLUMNS, MAX_DAYS
+from rng import RandomStreams, PATIENT_ZERO
+
+
+def run_ensemble(replicas,
+                 N,
+                 x_limit,
+                 y_limit,
+                 dist_limit,
+                 motion_factor=0.1,
+                 quantiles=(0.05, 0.5, 0.95),
+                 seed=None,
+                 simulation_id="sim_id_random",
+                 clusters=None,
+                 density=None):
+    """
+    Simulate many independent replicas of the epidemic at once
+
+    All replicas live in the same (replica x person) arrays and are stepped
+    by the same kernels as run_simulation. Each replica stops on its own
+    with the rules of run_simulation: nobody healthy is left, the stats did
+    not change for 9 days or the day cap is reached.
+
+    Returns the daily stats of every replica and a summary with the mean and
+    the quantiles of every column across the replicas. Replicas that
+    stopped early keep their last stats in the summary.
+
+    Replica r draws the same random numbers as replica r of any other
+    ensemble with the same seed, so ensembles can be split into batches
+    or across machines and still give the same results.
+
+    Keyword arguments:
+    replicas -- number of replicas to simulate
+    N -- Population size
+    x_limit -- max range on X-axis
+    y_limit -- max range on Y-axis
+    dist_limit -- safe social distance limit
+    motion_factor -- share of the population which moves (default: 0.1)
+    quantiles -- quantiles to summarize (default: 5%, median and 95%)
+    seed -- seed of the random numbers (default: fresh OS entropy)
+    simulation_id -- simulation ID of the stats
+    clusters -- number of clusters people gather around (default: none)
+    density -- 2D array of relative densities, rows along the Y-axis
+    """
+
+    assert isinstance(replicas, int)
+    assert isinstance(N, int)
+
+    streams = RandomStreams(seed)
+    dist_limit = float(dist_limit)
+
+    population = Population(N, replicas=replicas)
+    population.populate(streams,
+                        x_limit,
+                        y_limit,
+                        STATUS_TYPE,
+                        math.floor(float(motion_factor) * N),
+                        clusters=clusters,
+                        density=density)
+    initial_working_hours = population.total_working_hours.copy()
+    stats = StatsBuffer(MAX_DAYS, replicas=replicas)
+
+    ## Start every replica by infecting a random person
+    day = 0
+    first = (streams.uniform(PATIENT_ZERO, day, np.arange(replicas), 0) *
+             N).astype(np.int64)
+    population.infect(np.arange(replicas) * N + first, day)
+    stats.record(day, population, initial_working_hours)
+
+    last_day = np.full(replicas, MAX_DAYS)
+    running = np.ones(replicas, dtype=bool)
+    count_sames = np.zeros(replicas, dtype=np.int64)
+    while running.any():
+        yesterday_patients = population.state.copy()
+        day += 1
+        population.transition(day, streams)
+        population.walk(streams, day, x_limit, y_limit)
+        population.interact(yesterday_patients, day, dist_limit, x_limit,
+                            y_limit, streams)
+        stats.record(day, population, initial_working_hours)
+
+        count_sames = np.where(stats.unchanged(day), count_sames + 1, 0)
+        stop = running & ((stats.healthy(day) == 0) | (day >= MAX_DAYS) |
+                          (count_sames > 8))
+        last_day[stop] = day
+        running &= ~stop
+
+    stats_df = replica_stats(stats, last_day, simulation_id)
+    return stats_df, summarize(stats, last_day, quantiles)
+
+
+def replica_stats(stats, last_day, simulation_id):
+    """
+    Daily stats of every replica until the day it stopped
+    [replica,simulationID,Day,Healthy,Covid-19(+),Hospitalized,Cured,Dead,Work]
+
+    Keyword arguments:
+    stats -- stats buffer with replicas
+    last_day -- last simulated day of every replica
+    simulation_id -- simulation ID of the stats
+    """
+
+    days = np.arange(stats.days)
+    day, replica = np.nonzero(days[:, None] <= last_day[None, :])
+
+    stats_df = pd.DataFrame(stats.counts[day, replica],
+                            columns=STATS_COLUMNS[2:7])
+    stats_df.insert(0, 'replica', replica)
+    stats_df.insert(1, 'simulationID', simulation_id)
+    stats_df.insert(2, 'Day', day)
+    stats_df['Work'] = stats.work[day, replica]
+    return stats_df.sort_values(['replica', 'Day'], ignore_index=True)
+
+
+def summarize(stats, last_day, quantiles):
+    """
+    Mean and quantiles of every stats column across the replicas
+    [Day,status,mean,q<quantile>...]
+
+    Keyword arguments:
+    stats -- stats buffer with replicas
+    last_day -- last simulated day of every replica
+    quantiles -- quantiles to summarize
+    """
+
+    # Replicas which stopped keep the stats of their last day
+    days = np.arange(last_day.max() + 1)
+    held = np.minimum(days[:, None], last_day[None, :])
+    replica = np.arange(len(last_day))[None, :]
+    values = np.concatenate([
+        stats.counts[held, replica].astype(np.float64),
+        stats.work[held, replica][..., None]
+    ],
+                            axis=-1)
+
+    columns = STATS_COLUMNS[2:]
+    summary = {
+        'Day': np.repeat(days, len(columns)),
+        'status': np.tile(columns, len(days)),
+        'mean': values.mean(axis=1).reshape(-1)
+    }
+    for q, value in zip(quantiles, np.quantile(values, quantiles, axis=1)):
+        summary[f"q{q * 100:g}"] = value.reshape(-1)
+    return pd.DataFrame(summary)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Arguments for the COVID-19 Ensemble Simulation')
+    parser.add_argument('-simID',
+                        action="store",
+                        dest="simID",
+                        help='Simulation ID',
+                        default="sim_id_random")
+    parser.add_argument('-replicas',
+                        action="store",
+                        dest="replicas",
+                        type=int,
+                        default=100,
+                        help='Number of replicas to simulate')
+    parser.add_argument('-N',
+                        action="store",
+                        dest="N",
+                        type=int,
+                        default=300,
+                        help='Population Size to simulate')
+    parser.add_argument('-x_limit',
+                        action="store",
+                        dest="x_limit",
+                        type=int,
+                        default=30,
+                        help='X-axis limit of 2D canvas')
+    parser.add_argument('-y_limit',
+                        action="store",
+                        dest="y_limit",
+                        type=int,
+                        default=30,
+                        help='Y-axis limit of 2D canvas')
+    parser.add_argument('-dist_thres',
+                        action="store",
+                        dest="dist_limit",
+                        default=1.5,
+                        help='Distance threshold to infect another person')
+    parser.add_argument(
+        '-mov_rate',
+        action="store",
+        dest="mov_rate",
+        default=0.15,
+        help='Rate of infection spread, correlated with the motion')
+    parser.add_argument('-output',
+                        action="store",
+                        dest="output",
+                        default=None,
+                        help='Prefix of the csv files to write the stats to')
+    parser.add_argument('-seed',
+                        action="store",
+                        dest="seed",
+                        type=int,
+                        default=None,
+                        help='Seed of the random numbers, random by default')
+
+    args = parser.parse_args()
+
+    stats_df, summary_df = run_ensemble(args.replicas,
+                                        args.N,
+                                        args.x_limit,
+                                        args.y_limit,
+                                        args.dist_limit,
+                                        motion_factor=args.mov_rate,
+                                        seed=args.seed,
+                                        simulation_id=args.simID)
+    print(f"Summary DF : {summary_df}")
+    if args.output:
+        stats_df.to_csv(f"{args.output}_replicas.csv", index=False)
+        summary_df.to_csv(f"{args.output}_summary.csv", index=False)
@@ -0,0 +1,404 @@
+import numpy as np
+import pandas as pd
+
+from contacts import contact_pairs
+from rng import (SETUP_X, SETUP_Y, SETUP_MOVER, SETUP_STATUS, SETUP_CELL,
+                 SETUP_CENTRE, WALK_X, WALK_Y, TRANSITION, CONTACT)
+
+# Codes stored in the 'Covid-19' column
+HEALTHY = 0
+INFECTED = 1
+CURED = 7
+HOSPITALIZED = 115
+DEAD = 666
+
+# Compartments in the order of the stats columns
+COMPARTMENTS = (HEALTHY, INFECTED, HOSPITALIZED, CURED, DEAD)
+
+# Infection day of people who were never infected
+NO_DAY = -1
+
+# Share of the population in every working status
+STATUS_TYPE = {'Student': 0.1, 'Working': 0.7, 'Child': 0.1, 'Old': 0.1}
+
+
+class Population:
+    """
+    Structure-of-arrays store for the state of every person in the world
+
+    Every attribute is a contiguous NumPy array indexed by person id, so the
+    simulation phases can read and write whole columns at once instead of
+    going through DataFrame.loc one cell at a time.
+
+    The number of people in every compartment and the total working hours
+    are kept up to date by the kernels that change them, so reading the
+    daily stats does not need to scan the arrays.
+
+    With replicas the arrays are (replica x person) and every kernel steps
+    all the independent replicas of the world at once; the counters then
+    hold one value per replica.
+    """
+    def __init__(self, N, replicas=None, debug=False):
+        """
+        Allocate a population of N healthy, idle people at the origin
+
+        Keyword arguments:
+        N -- Population size
+        replicas -- number of independent worlds (default: a single one)
+        debug -- cross-check the counters against a full recount
+        """
+
+        assert isinstance(N, int)
+        assert replicas is None or isinstance(replicas, int)
+        assert isinstance(debug, bool)
+
+        shape = (N, ) if replicas is None else (replicas, N)
+        self.x = np.zeros(shape, dtype=np.float64)
+        self.y = np.zeros(shape, dtype=np.float64)
+        self.state = np.full(shape, HEALTHY, dtype=np.int16)
+        self.day = np.full(shape, NO_DAY, dtype=np.int32)
+        self.status = np.zeros(shape, dtype=np.int8)
+        self.status_labels = []
+        self.status_hours = np.zeros(1, dtype=np.int32)
+        self.working_hours = np.zeros(shape, dtype=np.int32)
+        self.mover = np.zeros(shape, dtype=bool)
+
+        self.debug = debug
+        self.counts = {}
+        self.total_working_hours = 0
+        self.recount()
+
+    def __len__(self):
+        return self.state.shape[-1]
+
+    def __repr__(self):
+        return f"Population(N={len(self)}, movers={int(self.mover.sum())})"
+
+    def recount(self):
+        """Recompute the counters from the arrays"""
+
+        self.counts = {
+            code: np.count_nonzero(self.state == code, axis=-1)
+            for code in COMPARTMENTS
+        }
+        self.total_working_hours = self.working_hours.sum(axis=-1)
+
+    def check_counters(self):
+        """Assert that the live counters match a full recount"""
+
+        counts, total_working_hours = self.counts, self.total_working_hours
+        self.recount()
+        for code in COMPARTMENTS:
+            assert np.array_equal(counts[code], self.counts[code]), \
+                f"{code}: counted {counts[code]}, found {self.counts[code]}"
+        assert np.array_equal(total_working_hours, self.total_working_hours), \
+            f"working hours: counted {total_working_hours}, " \
+            f"found {self.total_working_hours}"
+
+    def _per_replica(self, persons, weights=None):
+        """
+        Count (or sum the weights of) flat person ids in every replica
+
+        Keyword arguments:
+        persons -- flat person ids
+        weights -- value of every person (default: 1)
+        """
+
+        if self.state.ndim == 1:
+            return len(persons) if weights is None else weights.sum()
+        return np.bincount(persons // len(self),
+                           weights,
+                           minlength=self.state.shape[0]).astype(np.int64)
+
+    def _split(self, persons):
+        """
+        Replica and person id within the replica of flat person ids
+
+        Keyword arguments:
+        persons -- flat person ids
+        """
+
+        return np.divmod(persons, len(self))
+
+    @property
+    def movers_list(self):
+        """Ids of the people who are moving in the world"""
+        return np.flatnonzero(self.mover).tolist()
+
+    def populate(self,
+                 streams,
+                 x_limit,
+                 y_limit,
+                 status_type,
+                 movers,
+                 clusters=None,
+                 cluster_spread=1.0,
+                 density=None,
+                 chunk_size=1 << 20):
+        """
+        Fill every replica with random people
+
+        People are drawn in bulk, chunk_size at a time. Every person draws
+        from its own random numbers, so the people do not depend on the
+        chunk size and a replica gets the same people alone or among others.
+
+        People spread uniformly over the world by default. With clusters
+        they gather around random centres, with a density map every cell of
+        the map gets people in proportion to its density.
+
+        Keyword arguments:
+        streams -- RandomStreams of the simulation
+        x_limit -- max range on X-axis
+        y_limit -- max range on Y-axis
+        status_type -- probability of each working status
+        movers -- number of people moving in every replica
+        clusters -- number of clusters people gather around (default: none)
+        cluster_spread -- standard deviation of the distance to the centre
+        density -- 2D array of relative densities, rows along the Y-axis
+        chunk_size -- number of people drawn at once, bounds memory use
+        """
+
+        assert clusters is None or density is None
+
+        N = len(self)
+        replicas = self.state.shape[0] if self.state.ndim > 1 else 1
+        x, y = self.x.reshape(replicas, N), self.y.reshape(replicas, N)
+        status = self.status.reshape(replicas, N)
+        mover = self.mover.reshape(replicas, N)
+
+        self.status_labels = list(status_type)
+        self.status_hours = np.array(
+            [40 if status == 'Working' else 0 for status in status_type],
+            dtype=np.int32)
+        status_cdf = np.cumsum(list(status_type.values()))
+        status_cdf /= status_cdf[-1]
+
+        if density is not None:
+            density = np.asarray(density, dtype=np.float64)
+            rows, columns = density.shape
+            cell_cdf = np.cumsum(density.reshape(-1))
+            cell_cdf /= cell_cdf[-1]
+
+        for replica in range(replicas):
+            if clusters:
+                centre = np.arange(clusters)
+                centre_x = x_limit * streams.uniform(SETUP_CENTRE, 0, replica,
+                                                     2 * centre)
+                centre_y = y_limit * streams.uniform(SETUP_CENTRE, 0, replica,
+                                                     2 * centre + 1)
+
+            for begin in range(0, N, chunk_size):
+                end = min(begin + chunk_size, N)
+                person = np.arange(begin, end)
+                u = streams.uniform(SETUP_X, 0, replica, person)
+                v = streams.uniform(SETUP_Y, 0, replica, person)
+
+                if clusters:
+                    # Normal offset around the centre from u and v
+                    centre = (streams.uniform(SETUP_CELL, 0, replica, person) *
+                              clusters).astype(np.int64)
+                    radius = cluster_spread * np.sqrt(-2 * np.log1p(-u))
+                    angle = 2 * np.pi * v
+                    x[replica, begin:end] = (centre_x[centre] +
+                                             radius * np.cos(angle)) % x_limit
+                    y[replica, begin:end] = (centre_y[centre] +
+                                             radius * np.sin(angle)) % y_limit
+                elif density is not None:
+                    cell = np.minimum(
+                        np.searchsorted(cell_cdf,
+                                        streams.uniform(
+                                            SETUP_CELL, 0, replica, person),
+                                        side='right'), rows * columns - 1)
+                    row, column = np.divmod(cell, columns)
+                    x[replica, begin:end] = (column + u) * (x_limit / columns)
+                    y[replica, begin:end] = (row + v) * (y_limit / rows)
+                else:
+                    x[replica, begin:end] = x_limit * u
+                    y[replica, begin:end] = y_limit * v
+
+                status[replica, begin:end] = np.minimum(
+                    np.searchsorted(status_cdf,
+                                    streams.uniform(SETUP_STATUS, 0, replica,
+                                                    person),
+                                    side='right'),
+                    len(status_type) - 1)
+
+            # The movers are the people with the smallest keys
+            if movers >= N:
+                mover[replica] = True
+            elif movers > 0:
+                key = streams.uniform(SETUP_MOVER, 0, replica, np.arange(N))
+                chosen = np.argpartition(key, movers - 1)[:movers]
+                mover[replica, chosen] = True
+
+        self.working_hours[...] = self.status_hours[self.status]
+        self.recount()
+
+    def to_dataframe(self):
+        """
+        Convert the population to a covid dataframe
+        [X,Y,Covid-19,Day,status,working_hours]
+        """
+
+        assert self.state.ndim == 1
+
+        day = np.where(self.day == NO_DAY, np.nan, self.day)
+        status = np.asarray(self.status_labels, dtype=object)[self.status] \
+            if self.status_labels else np.full(len(self), None, dtype=object)
+        return pd.DataFrame({
+            'X': self.x,
+            'Y': self.y,
+            'Covid-19': self.state,
+            'Day': day,
+            'status': status,
+            'working_hours': self.working_hours
+        })
+
+    def walk(self, streams, day, x_limit, y_limit):
+        """
+        Move every mover one random step, wrapping around the world
+
+        Hospitalized and dead people stop moving for good.
+
+        Keyword arguments:
+        streams -- RandomStreams of the simulation
+        day -- current day
+        x_limit -- max range on X-axis
+        y_limit -- max range on Y-axis
+        """
+
+        self.mover &= (self.state != HOSPITALIZED) & (self.state != DEAD)
+
+        movers = np.flatnonzero(self.mover)
+        replica, person = self._split(movers)
+        step_x = 1 + (x_limit / 3 - 1) * streams.uniform(
+            WALK_X, day, replica, person)
+        step_y = 1 + (y_limit / 3 - 1) * streams.uniform(
+            WALK_Y, day, replica, person)
+        x, y = self.x.reshape(-1), self.y.reshape(-1)
+        x[movers] = (x[movers] + step_x) % x_limit
+        y[movers] = (y[movers] + step_y) % y_limit
+
+    def transition(self, day, streams, kill_prob=0.005, hosp_prob=0.03):
+        """
+        Kill, hospitalize and cure people in a single pass
+
+        A kill_prob share of all patients die among the infected, then a
+        hosp_prob share of the remaining infected go to hospital. Infected
+        people are cured after 10 days and hospitalized ones after 21 days.
+
+        Keyword arguments:
+        day -- current day
+        streams -- RandomStreams of the simulation
+        kill_prob -- kill people by kill_prob (default: 0.005)
+        hosp_prob -- Hospitalize people by hosp_prob (default: 0.03)
+        """
+
+        state, counts = self.state, self.counts
+        replica_shape = np.shape(counts[INFECTED])
+        n_infected = np.reshape(counts[INFECTED], -1)
+        n_hospitalized = np.reshape(counts[HOSPITALIZED], -1)
+
+        n_kill = np.floor(n_infected * kill_prob +
+                          n_hospitalized * kill_prob).astype(np.int64)
+        n_kill[n_kill > n_infected] = 0
+        n_hosp = np.floor((n_infected - n_kill) * hosp_prob).astype(np.int64)
+
+        # Shuffle the infected of every replica, the first ones die and the
+        # next ones go to hospital, which samples both groups without
+        # replacement at once
+        infected = np.flatnonzero(state == INFECTED)
+        replica, person = self._split(infected)
+        order = np.lexsort((streams.uniform(TRANSITION, day, replica,
+                                            person), replica))
+        infected, replica = infected[order], replica[order]
+        first = np.cumsum(n_infected) - n_infected
+        rank = np.arange(len(infected)) - first[replica]
+
+        flat_state = state.reshape(-1)
+        flat_state[infected[rank < n_kill[replica]]] = DEAD
+        flat_state[infected[(rank >= n_kill[replica])
+                            & (rank < (n_kill + n_hosp)[replica])]] = \
+            HOSPITALIZED
+        cured_infected = (state == INFECTED) & (self.day < day - 10)
+        cured_hospitalized = (state == HOSPITALIZED) & (self.day < day - 21)
+        cured = np.flatnonzero(cured_infected | cured_hospitalized)
+        flat_state[cured] = CURED
+
+        # Cured people go back to work
+        hours = self.status_hours[self.status.reshape(-1)[cured]]
+        self.working_hours.reshape(-1)[cured] = hours
+
+        n_kill = n_kill.reshape(replica_shape)
+        n_hosp = n_hosp.reshape(replica_shape)
+        n_cured_infected = np.count_nonzero(cured_infected, axis=-1)
+        n_cured_hospitalized = np.count_nonzero(cured_hospitalized, axis=-1)
+        counts[INFECTED] -= n_kill + n_hosp + n_cured_infected
+        counts[HOSPITALIZED] += n_hosp - n_cured_hospitalized
+        counts[CURED] += n_cured_infected + n_cured_hospitalized
+        counts[DEAD] += n_kill
+        self.total_working_hours += self._per_replica(cured, hours)
+
+    def infect(self, persons, day):
+        """
+        Infect the healthy people among persons
+
+        Infected people stop working.
+
+        Keyword arguments:
+        persons -- array of flat person ids, may contain duplicates
+        day -- current day
+        """
+
+        state = self.state.reshape(-1)
+        persons = np.unique(persons[state[persons] == HEALTHY])
+        state[persons] = INFECTED
+        self.day.reshape(-1)[persons] = day
+
+        working_hours = self.working_hours.reshape(-1)
+        self.total_working_hours -= self._per_replica(persons,
+                                                      working_hours[persons])
+        working_hours[persons] = 0
+        infected = self._per_replica(persons)
+        self.counts[HEALTHY] -= infected
+        self.counts[INFECTED] += infected
+
+    def interact(self, yesterday_patients, day, dist_limit, x_limit, y_limit,
+                 streams):
+        """
+        Infect the healthy people who met one of yesterday's patients
+
+        Keyword arguments:
+        yesterday_patients -- covid states of the people until yesterday
+        day -- current day
+        dist_limit -- safe social distance limit
+        x_limit -- max range on X-axis
+        y_limit -- max range on Y-axis
+        streams -- RandomStreams of the simulation
+        """
+
+        groups = None
+        if self.state.ndim > 1:
+            groups = np.arange(self.state.size) // len(self)
+
+        # Only yesterday's patients can infect, and only healthy people catch it
+        sources, persons = contact_pairs(
+            self.x.reshape(-1),
+            self.y.reshape(-1),
+            dist_limit,
+            x_limit,
+            y_limit,
+            sources=(yesterday_patients == INFECTED).reshape(-1),
+            targets=(self.state == HEALTHY).reshape(-1),
+            groups=groups)
+
+        # Every contact infects with the same chance as infect, drawn for the
+        # (source, target) pair whatever order the pairs were found in
+        if day > 3:
+            replica, source = self._split(sources)
+            target = persons % len(self)
+            contact = source * len(self) + target
+            persons = persons[
+                streams.uniform(CONTACT, day, replica, contact) <= 0.25]
+
+        self.infect(persons, day)
@@ -0,0 +1,86 @@
+import numpy as np
+
+# Phases of the simulation drawing random numbers
+SETUP_X = 1
+SETUP_Y = 2
+SETUP_MOVER = 3
+SETUP_STATUS = 4
+SETUP_CELL = 5
+SETUP_CENTRE = 6
+PATIENT_ZERO = 7
+WALK_X = 8
+WALK_Y = 9
+TRANSITION = 10
+CONTACT = 11
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+def _mix(z):
+    """SplitMix64 finalizer, a bijection scrambling every bit of z"""
+
+    z = (z ^ (z >> np.uint64(30))) * _MIX1
+    z = (z ^ (z >> np.uint64(27))) * _MIX2
+    return z ^ (z >> np.uint64(31))
+
+
+class RandomStreams:
+    """
+    Reproducible random numbers for every replica, phase and day
+
+    Numbers are derived from the seed and the position of the draw rather
+    than from a shared generator state. uniform hashes the id of every
+    person or pair with a key spawned from the seed for the (replica, day,
+    phase), so the same person gets the same number whatever order, chunk,
+    shard or process draws it in, and a parallel run matches a serial one
+    bit for bit.
+    """
+
+    def __init__(self, seed=None, replica=0):
+        """
+        Keyword arguments:
+        seed -- int or sequence of ints (default: fresh OS entropy)
+        replica -- replica id of the first replica using the streams
+        """
+
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.replica = replica
+        self._keys = {}
+
+    def _key(self, phase, day, replica):
+        """64-bit key of the stream of a (phase, day, replica)"""
+
+        stream = (phase, day, replica)
+        if stream not in self._keys:
+            self._keys[stream] = np.random.SeedSequence(
+                self.seed,
+                spawn_key=(replica, day, phase)).generate_state(1,
+                                                                np.uint64)[0]
+        return self._keys[stream]
+
+    def uniform(self, phase, day, replica, key):
+        """
+        Uniform numbers in [0, 1), one for every (replica, key) pair
+
+        Keyword arguments:
+        phase -- phase drawing the numbers
+        day -- current day
+        replica -- replica offset of every key, int or array
+        key -- non negative integer ids, e.g. person or pair ids
+        """
+
+        replica = np.asarray(replica)
+        streams = np.array([
+            self._key(phase, day, self.replica + r)
+            for r in range(int(replica.max(initial=0)) + 1)
+        ],
+                           dtype=np.uint64)
+        stream, key = np.broadcast_arrays(streams[replica], key)
+
+        # Arithmetic is modulo 2^64 on purpose
+        with np.errstate(over='ignore'):
+            z = _mix(stream + key.astype(np.uint64) * _GOLDEN)
+            z = _mix(z ^ stream)
+        return (z >> np.uint64(11)) * (1.0 / (1 << 53))
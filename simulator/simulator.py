@@ -1,322 +1,184 @@
-import random
 import math
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
 import argparse
 
-# clear data in elastic
-from elastic import Elastic  # needs to be changed to from simulator.elastic import Elastic when run from project root dir
-Elastic.clear_data('covid_df')
-Elastic.clear_data('stats_df')
-Elastic.clear_data('eco_df')
+from population import Population, STATUS_TYPE
+from stats import StatsBuffer, MAX_DAYS
+from rng import RandomStreams, PATIENT_ZERO
+# needs to be changed to from simulator.elastic import ... when run from project root dir
+from elastic import Elastic, DeltaExport, AsyncExport
 
 
-def point(x_limit, y_limit):
+def initalize_simulation_dataframes(N,
+                                    x_limit,
+                                    y_limit,
+                                    streams,
+                                    motion_factor=5,
+                                    debug=False,
+                                    clusters=None,
+                                    density=None):
     """
-    Generate a random 2D point
-
-    Keyword arguments:
-    x_limit -- max range on X-axis
-    y_limit -- max range on Y-axis
-    """
-
-    assert isinstance(x_limit, int)
-    assert isinstance(y_limit, int)
-
-    x = random.uniform(0, x_limit)
-    y = random.uniform(0, y_limit)
-    return x, y
-
-
-def initalize_simulation_dataframes(N, x_limit, y_limit, motion_factor=5):
-    """
-    Initialize simulation dataframes with random data
+    Initialize simulation population and dataframes with random data
 
     Keyword arguments:
     N -- Population size
     x_limit -- max range on X-axis
     y_limit -- max range on Y-axis
+    streams -- RandomStreams of the simulation
+    motion_factor -- number of people moving in the world
+    debug -- cross-check the population counters every day
+    clusters -- number of clusters people gather around (default: none)
+    density -- 2D array of relative densities, rows along the Y-axis
     """
 
     assert isinstance(N, int)
     assert isinstance(x_limit, int)
     assert isinstance(y_limit, int)
 
-    # Create the covid-19 dataframe, stores the state of all the actors in population
-    covid_df = pd.DataFrame(columns='X,Y,Covid-19,Day'.split(','))
-
-    for i in range(N):
-        covid_df.loc[i, 'X'], covid_df.loc[i, 'Y'] = point(x_limit, y_limit)
-        covid_df.loc[i, 'Covid-19'] = 0
-
-    sample_size = math.floor(motion_factor)
-    movers_list = covid_df.sample(n=sample_size).index.values.tolist()
-
-    # Dataframe to keep track of daily statistics
-    stats_df = pd.DataFrame(
-        columns=
-        'simulationID,Day,Healthy,Covid-19(+),Hospitalized,Cured,Dead,Work'.
-        split(','))
-    return covid_df, stats_df, movers_list
-
-
-def assign_working_status(covid_df, status_type):
-    """
-    Add working status for every person
-    Keyword arguments:
-    df -- covid dataframe [X,Y,Covid-19,Day]
-    """
-
-    print(covid_df.head())
-
-    N = len(covid_df)
-    status_list = []
-    working_hours = []
-    for status, prob in status_type.items():
-        status_list.extend([status] * int(prob * N))
-        if status == 'Working':
-            working_hours.extend([40] * int(prob * N))
-        else:
-            working_hours.extend([0] * int(prob * N))
-
-    if len(status_list) > N:
-        status_list = status_list[:N]
-
-    if len(working_hours) > N:
-        working_hours = working_hours[:N]
-
-    zip_list = list(zip(status_list, working_hours))
-
-    random.shuffle(zip_list)
-
-    status_list, working_hours = zip(*zip_list)
-
-    covid_df['status'] = status_list
-    covid_df['working_hours'] = working_hours
-    return covid_df
-
+    # Create the population, stores the state of all the actors in population
+    population = Population(N, debug=debug)
+    population.populate(streams,
+                        x_limit,
+                        y_limit,
+                        STATUS_TYPE,
+                        math.floor(motion_factor),
+                        clusters=clusters,
+                        density=density)
 
-def get_working_hours(covid_df):
-    """
-    Add working status for every person
-    Keyword arguments:
-    df -- covid dataframe [X,Y,Covid-19,Day, status, working_hours]
-    """
-    return covid_df['working_hours'].sum()
+    # Buffer to keep track of daily statistics
+    stats = StatsBuffer(MAX_DAYS)
+    return population, stats
 
 
-def update_working_hours(covid_df):
+def get_working_hours(population):
     """
-    Add working status for every person
+    Total working hours of the population
     Keyword arguments:
-    df -- covid dataframe [X,Y,Covid-19,Day,status, working_hours]
+    population -- population store
     """
-    print(covid_df.columns)
-    mask = (covid_df['Covid-19'] == 1)
-    covid_df['working_hours'][mask] = 0
-    mask1 = covid_df['Covid-19'] == 7
-    mask2 = covid_df['status'] == 'Working'
-    covid_df['working_hours'][mask1 & mask2] = 40
-
-    return covid_df
+    return int(population.total_working_hours)
 
 
-def infect(df, day, person):
+def infect(population, day, person, streams):
     """
     Infect a random person from the population
     Keyword arguments:
-    df -- covid dataframe [X,Y,Covid-19,Day]
+    population -- population store
     day -- current day
     person -- person_id to infect
+    streams -- RandomStreams of the simulation
     """
-    assert isinstance(df, pd.core.frame.DataFrame)
+    assert isinstance(population, Population)
     assert isinstance(day, int)
     assert isinstance(person, int)
-    assert person < len(df)
+    assert person < len(population)
 
-    if random.random() > 0.25 and day > 3:
-        return df
+    if day > 3 and streams.uniform(PATIENT_ZERO, day, 0, person) > 0.25:
+        return population
 
     ## If the person is not already infected, infect him/her and record the day of infection
-    if df.loc[person, 'Covid-19'] == 0:
-        df.loc[person, 'Covid-19'], df.loc[person, 'Day'] = 1, day
+    population.infect(np.array([person]), day)
 
-    return df
+    return population
 
 
-def update_stats_for_day(covid_df, stats_df, day, initial_working_hours):
+def update_stats_for_day(population, stats, day, initial_working_hours):
     """
     Update the statistics for the given day
     Keyword arguments:
-    covid_df -- covid dataframe [X,Y,Covid-19,Day]
-    stats_df -- stats dataframe [Healthy,Covid-19(+),Hospitalized,Cured,Dead]
+    population -- population store
+    stats -- stats buffer [Healthy,Covid-19(+),Hospitalized,Cured,Dead]
     day -- current day
     """
 
-    assert isinstance(covid_df, pd.core.frame.DataFrame)
-    assert isinstance(stats_df, pd.core.frame.DataFrame)
+    assert isinstance(population, Population)
+    assert isinstance(stats, StatsBuffer)
     assert isinstance(day, int)
 
-    covid_list = list(covid_df['Covid-19'])
+    if population.debug:
+        population.check_counters()
 
-    stats_df.loc[day, 'Day'] = day
-    stats_df.loc[day, 'Healthy'] = covid_list.count(0)
-    stats_df.loc[day, 'Covid-19(+)'] = covid_list.count(1)
-    stats_df.loc[day, 'Hospitalized'] = covid_list.count(115)
-    stats_df.loc[day, 'Cured'] = covid_list.count(7)
-    stats_df.loc[day, 'Dead'] = covid_list.count(666)
+    stats.record(day, population, initial_working_hours)
 
-    stats_df.loc[day, 'Work'] = (get_working_hours(covid_df) /
-                                 initial_working_hours) * 100
+    return population, stats
 
-    return covid_df, stats_df
 
-
-def kill(df, kill_prob=0.005):
+def transition(population, day, streams):
     """
-    Kill a fraction of population given by kill_prob
+    Kill, hospitalize and cure people for the day
     Keyword arguments:
-    df -- covid dataframe [X,Y,Covid-19,Day]
-    kill_prob -- kill people by kill_prob (default: 0.005)
-    """
-
-    assert isinstance(df, pd.core.frame.DataFrame)
-    assert isinstance(kill_prob, float)
-    assert kill_prob >= 0
-    assert kill_prob <= 1
-
-    samplesize = math.floor(
-        len(df[df['Covid-19'] == 1]) * kill_prob +
-        len(df[df['Covid-19'] == 115]) * kill_prob)
-    if samplesize > len(df[df['Covid-19'] == 1]): return
-    df.loc[df[df['Covid-19'] == 1].sample(n=samplesize).index.values.tolist(),
-           'Covid-19'] = 666
-    return df
-
-
-def hospitalize(df, hosp_prob=0.03):
-    """
-    Hospitalize a fraction of population given by hosp_prob
-    Keyword arguments:
-    df -- covid dataframe [X,Y,Covid-19,Day]
-    hosp_prob -- Hospitalize people by hosp_prob (default: 0.03)
-    """
-
-    assert isinstance(df, pd.core.frame.DataFrame)
-    assert isinstance(hosp_prob, float)
-    assert hosp_prob >= 0
-    assert hosp_prob <= 1
-
-    samplesize = math.floor(len(df[df['Covid-19'] == 1]) * hosp_prob)
-    if samplesize > len(df[df['Covid-19'] == 1]): return
-    df.loc[df[df['Covid-19'] == 1].sample(n=samplesize).index.values.tolist(),
-           'Covid-19'] = 115
-    return df
-
-
-def cure(df, day):
-    """
-    Cure people after their quarantine is finished
-    Keyword arguments:
-    df -- covid dataframe [X,Y,Covid-19,Day]
+    population -- population store
     day -- current day
+    streams -- RandomStreams of the simulation
     """
 
-    assert isinstance(df, pd.core.frame.DataFrame)
+    assert isinstance(population, Population)
     assert isinstance(day, int)
 
-    df.loc[(df['Day'] < day - 10) & (df['Covid-19'] == 1), 'Covid-19'] = 7
-    df.loc[(df['Day'] < day - 21) & (df['Covid-19'] == 115), 'Covid-19'] = 7
-    return df
+    population.transition(day, streams)
+    return population
 
 
-def random_walk(df, movers_list, x_limit, y_limit):
+def random_walk(population, day, x_limit, y_limit, streams):
     """
     Talk random steps in the world
     Keyword arguments:
-    df -- covid dataframe [X,Y,Covid-19,Day]
-    movers_list -- list of people who are moving in the world
+    population -- population store
+    day -- current day
     x_limit -- max range on X-axis
     y_limit -- max range on Y-axis
+    streams -- RandomStreams of the simulation
     """
-    for i in movers_list:
-        if (df.loc[i, 'Covid-19'] == 115) or (df.loc[i, 'Covid-19'] == 666):
-            movers_list.remove(i)
-
-        df.loc[i, 'X'], df.loc[i, 'Y'] = (
-            df.loc[i, 'X'] + random.uniform(1, x_limit / 3)) % x_limit, (
-                df.loc[i, 'Y'] + random.uniform(1, y_limit / 3)) % y_limit
+    population.walk(streams, day, x_limit, y_limit)
+    return population
 
-    return df, movers_list
 
-
-def simulate_next_day(covid_df, stats_df, day, movers_list, x_limit, y_limit):
+def simulate_next_day(population, stats, day, x_limit, y_limit, streams):
     """
     Simulates the next day given current day data
     Keyword arguments:
-    covid_df -- covid dataframe [X,Y,Covid-19,Day]
-    stats_df -- stats dataframe [Healthy,Covid-19(+),Hospitalized,Cured,Dead]
+    population -- population store
+    stats -- stats buffer [Healthy,Covid-19(+),Hospitalized,Cured,Dead]
     day -- current day
+    streams -- RandomStreams of the simulation
     """
 
-    assert isinstance(covid_df, pd.core.frame.DataFrame)
-    assert isinstance(stats_df, pd.core.frame.DataFrame)
+    assert isinstance(population, Population)
+    assert isinstance(stats, StatsBuffer)
     assert isinstance(day, int)
 
     day += 1
-    covid_df = kill(covid_df)
-    covid_df = hospitalize(covid_df)
-    covid_df = cure(covid_df, day)
-    covid_df, movers_list = random_walk(covid_df, movers_list, x_limit,
-                                        y_limit)
-
-    return covid_df, stats_df, day, movers_list
-
-
-def check(covid_df, i, j, yesterday_patients, dist_limit):
-    """
-    Checks if two people are close enough to infect eachother
-    Keyword arguments:
-    covid_df -- covid dataframe [X,Y,Covid-19,Day]
-    i -- first person
-    j -- second person
-    yesterday_patients -- List of covud(+) people until yesterday
-    dist_limit -- csafe social distance limit
-    """
-
-    assert isinstance(covid_df, pd.core.frame.DataFrame), type(covid_df)
-    assert isinstance(i, int)
-    assert isinstance(j, int)
-    assert isinstance(yesterday_patients, list)
-    assert isinstance(dist_limit, float)
+    population = transition(population, day, streams)
+    population = random_walk(population, day, x_limit, y_limit, streams)
 
-    dist = math.sqrt((covid_df.loc[i, 'X'] - covid_df.loc[j, 'X'])**2 +
-                     (covid_df.loc[i, 'Y'] - covid_df.loc[j, 'Y'])**2)
-    flag = ((yesterday_patients[i] == 1) ^
-            (yesterday_patients[j] == 1)) and dist < dist_limit
-    return flag
+    return population, stats, day
 
 
-def interact(covid_df, day, yesterday_patients, dist_limit):
+def interact(population, day, yesterday_patients, dist_limit, x_limit, y_limit,
+             streams):
     """
     Infect people who interact with oneanother
     Keyword arguments:
-    df -- covid dataframe [X,Y,Covid-19,Day]
+    population -- population store
     day -- current day
+    yesterday_patients -- covid states of the people until yesterday
+    dist_limit -- safe social distance limit
+    x_limit -- max range on X-axis
+    y_limit -- max range on Y-axis
+    streams -- RandomStreams of the simulation
     """
-    assert isinstance(covid_df, pd.core.frame.DataFrame)
+    assert isinstance(population, Population)
     assert isinstance(day, int)
+    assert isinstance(yesterday_patients, np.ndarray)
+    assert isinstance(dist_limit, float)
 
-    for i in range(len(covid_df)):
-        for j in range(i):
-            if check(covid_df, i, j, yesterday_patients, dist_limit):
-                if (covid_df.loc[i, 'Covid-19'] == 0):
-                    covid_df = infect(covid_df, day, i)
-                else:
-                    covid_df = infect(covid_df, day, j)
-    return covid_df
+    population.interact(yesterday_patients, day, dist_limit, x_limit, y_limit,
+                        streams)
+    return population
 
 
 def get_covid_df_plt_color(df):
@@ -465,7 +327,12 @@ def run_simulation(N,
                    motion_factor=0.1,
                    SHOW_PLOT_FLAG=False,
                    SAVE_PLOT_FLAG=False,
-                   simulation_id="sim_id_random"):  ## SIMULATION PARAMETERS
+                   simulation_id="sim_id_random",
+                   debug=False,
+                   export=True,
+                   seed=None,
+                   clusters=None,
+                   density=None):  ## SIMULATION PARAMETERS
     assert N is not None
     assert x_limit is not None
     assert y_limit is not None
@@ -480,107 +347,142 @@ def run_simulation(N,
     SHOW_PLOT_FLAG = bool(SHOW_PLOT_FLAG)
     SAVE_PLOT_FLAG = bool(SAVE_PLOT_FLAG)
 
-    print(f"Running Simulation with ID: {simulation_id}")
-
-    covid_df, stats_df, movers_list = initalize_simulation_dataframes(
-        N, x_limit, y_limit, motion_factor=MOTION_FACTOR)
-    print(f"covid_df: {covid_df}\n")
-    print(f"stats_df: {stats_df}\n")
-    print(f"movers_list: {movers_list}\n")
-
-    status_type = {'Student': 0.1, 'Working': 0.7, 'Child': 0.1, 'Old': 0.1}
+    # Every random number of the run derives from the seed
+    streams = RandomStreams(seed)
 
-    covid_df = assign_working_status(covid_df, status_type)
-    initial_working_hours = get_working_hours(covid_df)
+    print(f"Running Simulation with ID: {simulation_id}")
+    print(f"Seed: {streams.seed}")
+
+    if export:
+        # clear data in elastic
+        Elastic.clear_data('covid_df')
+        Elastic.clear_data('stats_df')
+        Elastic.clear_data('eco_df')
+        # Days are uploaded in the background while the next ones run
+        exporter = AsyncExport(DeltaExport(simulation_id))
+
+    population, stats = initalize_simulation_dataframes(
+        N,
+        x_limit,
+        y_limit,
+        streams,
+        motion_factor=MOTION_FACTOR,
+        debug=debug,
+        clusters=clusters,
+        density=density)
+    print(f"population: {population}\n")
+    print(f"movers: {population.mover.sum()}\n")
+
+    initial_working_hours = get_working_hours(population)
 
     ## Start the simulation by infecting a random person
-    random_person = random.randrange(N)
-    covid_df = infect(covid_df, day, random_person)
+    random_person = int(streams.uniform(PATIENT_ZERO, day, 0, 0) * N)
+    population = infect(population, day, random_person, streams)
 
     print("-" * 20)
     print(f"Random Person: {random_person}")
-    print(f"covid_df (After infecting a person): {covid_df}")
-    print(f"{covid_df.loc[random_person]}")
-
-    covid_df = update_working_hours(covid_df)
+    print(f"population (After infecting a person): {population}")
+    status = population.status_labels[population.status[random_person]]
+    print(f"X: {population.x[random_person]}, "
+          f"Y: {population.y[random_person]}, "
+          f"Covid-19: {population.state[random_person]}, "
+          f"Day: {population.day[random_person]}, "
+          f"status: {status}, "
+          f"working_hours: {population.working_hours[random_person]}")
 
     ## Plot the static graph
-    print("-" * 20)
-    print("PLOTTING FIGURE")
-    fig, axs = plt.subplots(3)
-    fig.suptitle('Covid-19 Epidemic Sample Model', fontsize=16)
-    plot_day(covid_df,
-             fig,
-             axs,
-             stats_df,
-             day,
-             movers_list,
-             show=SHOW_PLOT_FLAG,
-             savefig=SAVE_PLOT_FLAG)
+    PLOT_FLAG = SHOW_PLOT_FLAG or SAVE_PLOT_FLAG
+    if PLOT_FLAG:
+        print("-" * 20)
+        print("PLOTTING FIGURE")
+        fig, axs = plt.subplots(3)
+        fig.suptitle('Covid-19 Epidemic Sample Model', fontsize=16)
+        plot_day(population.to_dataframe(),
+                 fig,
+                 axs,
+                 stats.to_dataframe(simulation_id),
+                 day,
+                 population.movers_list,
+                 show=SHOW_PLOT_FLAG,
+                 savefig=SAVE_PLOT_FLAG)
 
     ## Plot the static graph
     print("-" * 20)
-    covid_df, stats_df = update_stats_for_day(covid_df, stats_df, day,
-                                              initial_working_hours)
-    covid_df = update_working_hours(covid_df)
-
-    yesterday_patients = list(covid_df['Covid-19'])
-    covid_df, stats_df, day, movers_list = simulate_next_day(
-        covid_df, stats_df, day, movers_list, x_limit, y_limit)
-    covid_df = interact(covid_df, day, yesterday_patients, dist_limit)
+    population, stats = update_stats_for_day(population, stats, day,
+                                             initial_working_hours)
+    yesterday_patients = population.state.copy()
+    population, stats, day = simulate_next_day(population, stats, day, x_limit,
+                                               y_limit, streams)
+    population = interact(population, day, yesterday_patients, dist_limit,
+                          x_limit, y_limit, streams)
 
     ## Day 1
-    Elastic.load_sim_data(covid_df, stats_df)
-    plot_day(covid_df,
-             fig,
-             axs,
-             stats_df,
-             day,
-             movers_list,
-             show=SHOW_PLOT_FLAG,
-             savefig=SAVE_PLOT_FLAG)
-    covid_df, stats_df = update_stats_for_day(covid_df, stats_df, day,
-                                              initial_working_hours)
+    if export or PLOT_FLAG:
+        covid_df = population.to_dataframe()
+        stats_df = stats.to_dataframe(simulation_id)
+    if export:
+        exporter.export(day, covid_df, stats_df)
+    if PLOT_FLAG:
+        plot_day(covid_df,
+                 fig,
+                 axs,
+                 stats_df,
+                 day,
+                 population.movers_list,
+                 show=SHOW_PLOT_FLAG,
+                 savefig=SAVE_PLOT_FLAG)
+    population, stats = update_stats_for_day(population, stats, day,
+                                             initial_working_hours)
 
     count_sames = 0
-    stats_df['simulationID'] = simulation_id
-    while stats_df.loc[day, 'Healthy'] > 0 and day < 100:
-        if (list(stats_df.loc[day]) == list(stats_df.loc[day - 1])):
+    while stats.healthy(day) > 0 and day < MAX_DAYS:
+        if stats.unchanged(day):
             count_sames += 1
             if count_sames > 8:
                 break
         else:
             count_sames = 0
 
-        yesterday_patients = list(covid_df['Covid-19'])
-        covid_df, stats_df, day, movers_list = simulate_next_day(
-            covid_df, stats_df, day, movers_list, x_limit, y_limit)
-        covid_df = interact(covid_df, day, yesterday_patients, dist_limit)
-        covid_df = update_working_hours(covid_df)
-        working_hours = get_working_hours(covid_df)
-        Elastic.load_sim_data(covid_df, stats_df)
-        plot_day(covid_df,
-                 fig,
-                 axs,
-                 stats_df,
-                 day,
-                 movers_list,
-                 show=SHOW_PLOT_FLAG,
-                 savefig=SAVE_PLOT_FLAG)
-        covid_df, stats_df = update_stats_for_day(covid_df, stats_df, day,
-                                                  initial_working_hours)
-        stats_df['simulationID'] = simulation_id
+        yesterday_patients = population.state.copy()
+        population, stats, day = simulate_next_day(population, stats, day,
+                                                   x_limit, y_limit, streams)
+        population = interact(population, day, yesterday_patients, dist_limit,
+                              x_limit, y_limit, streams)
+        working_hours = get_working_hours(population)
+        if export or PLOT_FLAG:
+            covid_df = population.to_dataframe()
+            stats_df = stats.to_dataframe(simulation_id)
+        if export:
+            exporter.export(day, covid_df, stats_df)
+        if PLOT_FLAG:
+            plot_day(covid_df,
+                     fig,
+                     axs,
+                     stats_df,
+                     day,
+                     population.movers_list,
+                     show=SHOW_PLOT_FLAG,
+                     savefig=SAVE_PLOT_FLAG)
+        population, stats = update_stats_for_day(population, stats, day,
+                                                 initial_working_hours)
 
         print(31 * '-')
         print('Day:', day)
         print(8 * '- - ')
         print("----------------")
         # print(f"Covid DF: {covid_df}")
-        print(f"Stats DF : {stats_df}")
+        print(f"Stats : {stats.counts[day]}")
         print(f"Total Working Hours: {working_hours}")
-
-    plt.show()
+        if export:
+            print(f"Export queue: {exporter.depth}, "
+                  f"blocked: {exporter.blocked:.2f}s")
+
+    if export:
+        exporter.close()
+    if SHOW_PLOT_FLAG:
+        plt.show()
     # plt.savefig('Stat')
+    return stats.to_dataframe(simulation_id)
 
 
 if __name__ == "__main__":
@@ -625,14 +527,39 @@ if __name__ == "__main__":
         help='Rate of infection spread, correlated with the motion')
     parser.add_argument('-show_plot',
                         action="store_true",
-                        default="False",
+                        default=False,
                         dest='show_plot',
                         help='Shows plot, Keep it false on a server')
     parser.add_argument('-save_plot',
                         action="store_true",
-                        default="False",
+                        default=False,
                         dest='save_plot',
                         help='Saves plot on the disk')
+    parser.add_argument('-debug',
+                        action="store_true",
+                        dest='debug',
+                        help='Cross-check the daily stats with a full recount')
+    parser.add_argument('-no_export',
+                        action="store_true",
+                        dest='no_export',
+                        help='Do not load the results into Elasticsearch')
+    parser.add_argument('-seed',
+                        action="store",
+                        dest="seed",
+                        type=int,
+                        default=None,
+                        help='Seed of the random numbers, random by default')
+    parser.add_argument('-clusters',
+                        action="store",
+                        dest="clusters",
+                        type=int,
+                        default=None,
+                        help='Number of clusters people gather around')
+    parser.add_argument('-density_map',
+                        action="store",
+                        dest="density_map",
+                        default=None,
+                        help='Csv grid of relative densities, rows along Y')
 
     args = parser.parse_args()
 
@@ -643,4 +570,10 @@ if __name__ == "__main__":
                    motion_factor=args.mov_rate,
                    simulation_id=args.simID,
                    SHOW_PLOT_FLAG=args.show_plot,
-                   SAVE_PLOT_FLAG=args.save_plot)
+                   SAVE_PLOT_FLAG=args.save_plot,
+                   debug=args.debug,
+                   export=not args.no_export,
+                   seed=args.seed,
+                   clusters=args.clusters,
+                   density=np.loadtxt(args.density_map, delimiter=',', ndmin=2)
+                   if args.density_map else None)
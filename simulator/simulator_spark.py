@@ -1,131 +1,156 @@
 import argparse
 import math
+import os
 import random
 import time
-import uuid
 
-import boto3
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 from elasticsearch import Elasticsearch
-from elasticsearch import helpers
-from pyspark import SparkContext
+from pyspark import SparkContext, StorageLevel
 from pyspark.sql import *
 from pyspark.sql import functions as F
 
+from elastic import Elastic, AsyncExport, LEGEND, bulk_load
+from population import COMPARTMENTS, INFECTED, HOSPITALIZED
+from rng import (SETUP_X, SETUP_Y, SETUP_MOVER, SETUP_STATUS, WALK_X, WALK_Y,
+                 TRANSITION)
+from stats import StatsBuffer
 
-def ssm_param(ssm_client, param: str) -> str:
-    response = ssm_client.get_parameter(Name=f"/spark_simulation_app/{param}", WithDecryption=True)
-    return response['Parameter']['Value']
-
-
-class Elastic:
-    ssm_client = boto3.client("ssm", region_name="us-east-1")
-    cloud_id = ssm_param(ssm_client, "cloud_id")
-    username = ssm_param(ssm_client, "username")
-    password = ssm_param(ssm_client, "password")
-
-    @staticmethod
-    def load_sim_data(_covid_df, _stats_df):
-        """Wrapper to load simulation data"""
-
-        # make a copy so original values are not transformed
-        covid_df = _covid_df.copy()
-        stats_df = _stats_df.copy()
-
-        # transform the values in covid_df for legend
-        D = {
-            0: 'Healthy',
-            1: 'Infected',
-            666: 'Dead',
-            115: 'Hospitalized',
-            7: 'Cured'
-        }
-        for k, v in D.items():
-            covid_df.loc[covid_df['Covid-19'] == k, 'Covid-19'] = v
-
-        # transform the values in stats_df for legend and to show multicolor lines
-        temp_df = pd.DataFrame(columns=['day', 'status', 'value'])
-        eco_df = pd.DataFrame(columns=['day', 'percentage', 'type'])
-        stats_df = stats_df.drop(['simulationID', 'Work'], axis=1)
-        for i in range(len(stats_df)):
-            for col in stats_df.columns:
-                doc = {'day': i, 'status': col, 'value': stats_df.loc[i][col]}
-                temp_df = temp_df.append(doc, ignore_index=True)
-            eco_df = eco_df.append(
-                {
-                    'day': i,
-                    'percentage': _stats_df.loc[i]['Work'],
-                    'type': 'Work'
-                },
-                ignore_index=True)
-            eco_df = eco_df.append(
-                {
-                    'day': i,
-                    'percentage': 50,
-                    'type': 'Threshold'
-                },
-                ignore_index=True)
-
-        stats_df = temp_df
-
-        Elastic.load_data(covid_df, "covid_df")
-        Elastic.load_data(stats_df, "stats_df")
-        Elastic.load_data(eco_df, "eco_df")
-
-    @staticmethod
-    def load_data(data, index):
-
-        es = Elasticsearch(cloud_id=Elastic.cloud_id,
-                           http_auth=(Elastic.username, Elastic.password))
-
-        # to make the index if it doesn't exist
-        es.index(index, data.iloc[0].to_json(), id=0)
-
-        # Bulk insert
-        actions = [{
-            "_index": index,
-            "_type": "_doc",
-            "_id": str(uuid.uuid4()),
-            "_source": data.loc[j].to_json()
-        } for j in range(0, len(data))]
-
-        st = time.time()
-        helpers.bulk(es, actions)
-        end = time.time()
-        print("total time to bulk insert", end - st)
-
-        es.indices.refresh(index=index)
-
-def point(x_limit, y_limit):
-    """
-    Generate a random 2D point
 
+# Days after which a simulation stops
+MAX_DAYS = 20
+
+# Modules of the simulator imported by the app and its executors
+SIMULATOR_MODULES = ("contacts.py", "elastic.py", "population.py", "rng.py",
+                     "stats.py")
+
+
+def load_rows(rows, index, options, bulk_options):
+    """
+    Bulk insert the rows of a partition, runs on the executors
+    One client serves every bulk request of the partition, the rows come
+    with their document id and their document already serialized to JSON.
     Keyword arguments:
-    x_limit -- max range on X-axis
-    y_limit -- max range on Y-axis
+    rows -- iterator over the (_id, _source) rows of a partition
+    index -- elasticsearch index
+    options -- keyword arguments of the Elasticsearch client
+    bulk_options -- keyword arguments of bulk_load
     """
 
-    assert isinstance(x_limit, int)
-    assert isinstance(y_limit, int)
+    es = Elasticsearch(**options)
+    actions = ({
+        "_index": index,
+        "_type": "_doc",
+        "_id": row[0],
+        "_source": row[1]
+    } for row in rows)
+    bulk_load(es, actions, **bulk_options)
 
-    x = random.uniform(0, x_limit)
-    y = random.uniform(0, y_limit)
-    return x, y
 
+def load_sim_data(covid_df, stats_df, simulation_id, day):
+    """
+    Wrapper to load simulation data
+    The executors load their partitions of the spark covid_df, only the
+    small pandas stats_df goes through the driver. Documents get stable
+    ids from the simulation ID, the day and the pid or status.
+    Keyword arguments:
+    covid_df -- covid dataframe of the people to load
+    stats_df -- pandas stats dataframe of the days to load
+    simulation_id -- simulation ID of the documents
+    day -- current day
+    """
+
+    # transform the values in covid_df for legend
+    legend = F.create_map([F.lit(x) for item in LEGEND.items() for x in item])
+    document = F.struct(
+        "pid", "X", "Y", legend[covid_df["Covid-19"]].alias("Covid-19"),
+        F.when(F.isnan("Day"), None).otherwise(covid_df["Day"]).alias("Day"),
+        "status", "working_hours",
+        F.lit(simulation_id).alias("simulationID"),
+        F.lit(day).alias("day"))
+
+    # The documents are serialized by spark, not row by row in python
+    covid_df = covid_df.select(
+        F.concat(F.lit(f"{simulation_id}-{day}-"),
+                 covid_df["pid"].cast("string")).alias("_id"),
+        F.to_json(document).alias("_source"))
+
+    stats_df, eco_df = Elastic.stats_documents(stats_df)
+
+    options, bulk_options = Elastic.options(), Elastic.bulk_options()
+    covid_df.foreachPartition(
+        lambda rows: load_rows(rows, "covid_df", options, bulk_options))
+    Elastic.connect().indices.refresh(index="covid_df")
+    Elastic.load_data(
+        stats_df, "stats_df", simulation_id + "-" +
+        stats_df["day"].astype(str) + "-" + stats_df["status"])
+    Elastic.load_data(
+        eco_df, "eco_df",
+        simulation_id + "-" + eco_df["day"].astype(str) + "-" + eco_df["type"])
+
+
+class DeltaExport:
+    """
+    Daily export of a simulation which only sends what changed
+    The first export sends the whole population, the next ones only the
+    people whose state or position changed since yesterday, which
+    simulate_next_day keeps in the yesterday column, and the stats rows
+    which were not sent yet.
+    """
 
-def initalize_simulation_dataframes(N,
+    def __init__(self, simulation_id):
+        """
+        Keyword arguments:
+        simulation_id -- simulation ID of the documents
+        """
+
+        self.simulation_id = simulation_id
+        self.first = True
+        self.stats_days = 0  # stats rows already sent
+
+    def export(self, day, covid_df, stats_df):
+        """
+        Send the changes since the last export
+        Keyword arguments:
+        day -- current day
+        covid_df -- covid dataframe [pid,X,Y,Covid-19,Day,yesterday,...]
+        stats_df -- pandas stats dataframe of the simulation
+        """
+
+        if not self.first:
+            covid_df = covid_df.filter(~covid_df["yesterday"].eqNullSafe(
+                F.struct("X", "Y", "Covid-19")))
+        self.first = False
+
+        # Only the days recorded since the last export
+        stats_df = stats_df.iloc[self.stats_days:]
+        self.stats_days += len(stats_df)
+        load_sim_data(covid_df, stats_df, self.simulation_id, day)
+
+
+def initalize_simulation_dataframes(sqlContext,
+                                    N,
                                     x_limit,
                                     y_limit,
                                     status_type,
-                                    motion_factor=5):
+                                    seed,
+                                    motion_factor=0.1):
     """
     Initialize simulation dataframes with random data
+    The people are generated on the executors from a range of pids, every
+    column is drawn with keyed_rand so the population only depends on the
+    seed and not on the partitioning.
 
     Keyword arguments:
+    sqlContext -- SQL context of the spark app
     N -- Population size
     x_limit -- max range on X-axis
     y_limit -- max range on Y-axis
+    status_type -- working status -> share of the population
+    seed -- seed of the simulation
+    motion_factor -- share of the population which moves (default: 0.1)
     """
 
     assert isinstance(N, int)
@@ -133,138 +158,96 @@ def initalize_simulation_dataframes(N,
     assert isinstance(y_limit, int)
 
     # Create the covid-19 dataframe, stores the state of all the actors in population
-    covid_df = pd.DataFrame(columns="pid,X,Y,Covid-19,Day".split(","))
-
-    for i in range(N):
-        covid_df.loc[i, "X"], covid_df.loc[i, "Y"] = point(x_limit, y_limit)
-        covid_df.loc[i, "pid"] = i
-        covid_df.loc[i, "Covid-19"] = 0
-
-    sample_size = math.floor(motion_factor)
-    movers_list = covid_df.sample(n=sample_size).index.values.tolist()
-
-    covid_df = assign_working_status(covid_df, status_type)
-
-    # data_frame to keep track of daily statistics
-    stats_df = pd.DataFrame(
-        columns=
-        "simulationID,Day,Healthy,Covid-19(+),Hospitalized,Cured,Dead,Work".
-            split(","))
-    return covid_df, stats_df, movers_list
-
-
-def assign_working_status(covid_df, status_type):
-    """
-    Add working status for every person
-    Keyword arguments:
-    df -- covid dataframe [X,Y,Covid19,Day]
-    """
-
-    N = len(covid_df)
-
-    status_list = []
-    working_hours = []
-    for status, prob in status_type.items():
-        status_list.extend([status] * int(prob * N))
-        if status == "Working":
-            working_hours.extend([40] * int(prob * N))
-        else:
-            working_hours.extend([0] * int(prob * N))
-
-    if len(status_list) > N:
-        status_list = status_list[:N]
-
-    if len(working_hours) > N:
-        working_hours = working_hours[:N]
-
-    zip_list = list(zip(status_list, working_hours))
-
-    random.shuffle(zip_list)
+    covid_df = sqlContext.range(N).withColumnRenamed("id", "pid")
+
+    # Pick the working status by inverse CDF over the shares
+    chance = keyed_rand(seed, SETUP_STATUS, 0)
+    status, bound = None, 0.0
+    for name, prob in status_type.items():
+        bound += prob
+        status = (F.when(chance < bound, name) if status is None else
+                  status.when(chance < bound, name))
+    status = status.otherwise(name)
+
+    covid_df = covid_df.select(
+        "pid", (keyed_rand(seed, SETUP_X, 0) * x_limit).alias("X"),
+        (keyed_rand(seed, SETUP_Y, 0) * y_limit).alias("Y"),
+        F.lit(0).alias("Covid-19"),
+        F.lit(float("nan")).alias("Day"), status.alias("status"),
+        (keyed_rand(seed, SETUP_MOVER, 0) < float(motion_factor)).alias(
+            "is_mover"))
+    covid_df = covid_df.withColumn(
+        "working_hours",
+        F.when(covid_df["status"] == "Working", 40).otherwise(0))
 
-    status_list, working_hours = zip(*zip_list)
-    covid_df["status"] = status_list
-    covid_df["working_hours"] = working_hours
-    return covid_df
+    # daily statistics, kept on the driver
+    stats = StatsBuffer(MAX_DAYS)
+    return covid_df, stats
 
 
 def get_working_hours(covid_df):
     """
-    Add working status for every person
+    Total working hours of the population
     Keyword arguments:
     df -- covid dataframe [X,Y,Covid-19,Day, status, working_hours]
     """
-    return covid_df.groupBy("working_hours").sum().collect()[-1][-1]
+    return covid_df.agg(F.sum("working_hours")).first()[0]
 
 
-def infect(df, day, person):
+def infect(df, day, persons, broadcast=False):
     """
-    Infect a random person from the population
+    Infect the healthy people among persons
+    The people to infect are joined onto the population on the executors,
+    the state and the infection day then change in a single projection.
     Keyword arguments:
     df -- covid dataframe [X,Y,Covid-19,Day]
     day -- current day
-    person -- person_id to infect
+    persons -- dataframe with the pid of the people to infect
+    broadcast -- broadcast persons to the executors, for small sets
     """
     assert isinstance(day, int)
-    assert isinstance(person, int)
-    assert person < df.count()
 
-    if random.random() > 0.25 and day > 3:
-        return df
+    persons = persons.select("pid").distinct().withColumn(
+        "infected_today", F.lit(True))
+    if broadcast:
+        persons = F.broadcast(persons)
+    joined = df.join(persons, "pid", "left")
 
     # If the person is not already infected, infect him/her and record the day of infection
-    df = df.withColumn(
-        "Covid-19",
-        F.when(df["pid"] == person, 1).otherwise(df["Covid-19"]))
-    df = df.withColumn("Day",
-                       F.when(df["pid"] == person, day).otherwise(df["Day"]))
-    return df
-
-
-def update_stats_for_day(sc, simID, covid_df, stats_df, day,
-                         initial_working_hours):
+    newly_infected = joined["infected_today"].isNotNull() & (
+        joined["Covid-19"] == 0)
+    columns = {
+        "Covid-19":
+        F.when(newly_infected, 1).otherwise(joined["Covid-19"]),
+        "Day": F.when(newly_infected, day).otherwise(joined["Day"]),
+    }
+    return joined.select([
+        columns[name].alias(name) if name in columns else joined[name]
+        for name in df.columns
+    ])
+
+
+def update_stats_for_day(covid_df, stats, day, initial_working_hours):
     """
     Update the statistics for the given day
+    The counts of every compartment and the working hours come back to the
+    driver in a single aggregation and are stored in the stats buffer.
     Keyword arguments:
-    covid_df -- covid dataframe [X,Y,Covid-19,Day]
-    stats_df -- stats dataframe [Healthy,Covid-19(+),Hospitalized,Cured,Dead]
+    covid_df -- covid dataframe [X,Y,Covid-19,Day,working_hours]
+    stats -- stats buffer of the simulation
     day -- current day
+    initial_working_hours -- working hours of the healthy population
     """
     assert isinstance(day, int)
 
-    covid_count_list = dict(covid_df.groupBy("Covid-19").count().collect())
-
-    for value in [1, 0, 115, 7, 666]:
-        if value not in covid_count_list.keys():
-            covid_count_list[value] = 0
+    state = covid_df["Covid-19"]
+    aggregates = covid_df.agg(
+        *[F.count(F.when(state == code, True)) for code in COMPARTMENTS],
+        F.sum("working_hours")).first()
 
-    if day == 0:
-        stats_df.loc[day, "simulationID"] = simID
-        stats_df.loc[day, "Day"] = day
-        stats_df.loc[day, "Healthy"] = covid_count_list[0]
-        stats_df.loc[day, "Covid-19(+)"] = covid_count_list[1]
-        stats_df.loc[day, "Hospitalized"] = covid_count_list[115]
-        stats_df.loc[day, "Cured"] = covid_count_list[7]
-        stats_df.loc[day, "Dead"] = covid_count_list[666]
-
-        stats_df.loc[day, "Work"] = (get_working_hours(covid_df) /
-                                     initial_working_hours) * 100
-    else:
-        working_hours = (get_working_hours(covid_df) /
-                         initial_working_hours) * 100
-        newRow = sc.createDataFrame([(
-            simID,
-            day,
-            covid_count_list[0],
-            covid_count_list[1],
-            covid_count_list[115],
-            covid_count_list[7],
-            covid_count_list[666],
-            working_hours,
-        )])
-
-        stats_df = stats_df.union(newRow)
-
-    return covid_df, stats_df
+    stats.store(day, aggregates[:-1],
+                (aggregates[-1] / initial_working_hours) * 100)
+    return covid_df, stats
 
 
 def update_working_hours(covid_df):
@@ -286,193 +269,384 @@ def update_working_hours(covid_df):
     return covid_df
 
 
-def kill(df, kill_prob=0.005):
+def keyed_rand(seed, phase, day):
     """
-    Kill a fraction of population given by kill_prob
+    Uniform random column in [0, 1) drawn for every person
+    The number only depends on the seed, the phase, the day and the pid,
+    so unlike F.rand it does not change with the partitioning of the
+    dataframe or when a lost partition is recomputed.
     Keyword arguments:
-    df -- covid dataframe [X,Y,Covid-19,Day]
-    kill_prob -- kill people by kill_prob (default: 0.005)
+    seed -- seed of the simulation
+    phase -- phase of the day drawing the numbers
+    day -- current day
     """
 
-    assert isinstance(kill_prob, float)
-    assert kill_prob >= 0
-    assert kill_prob <= 1
+    h = F.hash(F.lit(seed), F.lit(phase), F.lit(day), F.col("pid"))
+    return (h.cast("long") + 2**31) / float(2**32)
 
-    sample_size = math.floor(
-        df.filter((df["Covid-19"] == 1) | (df["Covid-19"] == 115)).count() *
-        kill_prob)
 
-    try:
-        sample_fraction = sample_size / df.filter(df["Covid-19"] == 1).count()
-    except ZeroDivisionError:
-        sample_fraction = 0
+def transition_fractions(n_infected, n_hospitalized, kill_prob, hosp_prob):
+    """
+    Shares of the infected people to kill and to hospitalize
+    A kill_prob share of all patients die among the infected, then a
+    hosp_prob share of the remaining infected go to hospital.
+    Keyword arguments:
+    n_infected -- number of infected people
+    n_hospitalized -- number of hospitalized people
+    kill_prob -- kill people by kill_prob
+    hosp_prob -- Hospitalize people by hosp_prob
+    """
 
-    if sample_size > df.filter(df["Covid-19"] == 1).count():
-        return df
+    if n_infected == 0:
+        return 0.0, 0.0
 
-    df = df.withColumn("survival_chance", F.rand())
-    df = df.withColumn(
-        "Covid-19",
-        F.when(
-            (df["Covid-19"] == 1) & (df["survival_chance"] < sample_fraction),
-            666).otherwise(df["Covid-19"]),
-    )
-    df = df.drop("survival_chance")
-    return df
+    n_kill = math.floor((n_infected + n_hospitalized) * kill_prob)
+    if n_kill > n_infected:
+        n_kill = 0
+    n_hosp = math.floor((n_infected - n_kill) * hosp_prob)
+    return n_kill / n_infected, n_hosp / n_infected
 
 
-def hospitalize(df, hosp_prob=0.3):
+def transition(df, day, counts, seed, kill_prob=0.005, hosp_prob=0.3):
     """
-    Hospitalize a fraction of population given by hosp_prob
+    Kill, hospitalize and cure people in a single projection
+    The shares to kill and hospitalize come from yesterday's stats, so the
+    step does not run any spark job. Infected people are cured after 10
+    days and hospitalized ones after 21 days.
     Keyword arguments:
     df -- covid dataframe [X,Y,Covid-19,Day]
-    hosp_prob -- Hospitalize people by hosp_prob (default: 0.03)
+    day -- current day
+    counts -- compartment counts of yesterday, in COMPARTMENTS order
+    seed -- seed of the simulation
+    kill_prob -- kill people by kill_prob (default: 0.005)
+    hosp_prob -- Hospitalize people by hosp_prob (default: 0.3)
     """
 
+    assert isinstance(day, int)
+    assert isinstance(kill_prob, float)
+    assert 0 <= kill_prob <= 1
     assert isinstance(hosp_prob, float)
-    assert hosp_prob >= 0
-    assert hosp_prob <= 1
+    assert 0 <= hosp_prob <= 1
 
-    sample_size = math.floor(
-        df.filter(df["Covid-19"] == 1).count() * hosp_prob)
-    sample_fraction = sample_size / df.filter(df["Covid-19"] == 1).count()
+    kill_fraction, hosp_fraction = transition_fractions(
+        counts[COMPARTMENTS.index(INFECTED)],
+        counts[COMPARTMENTS.index(HOSPITALIZED)], kill_prob, hosp_prob)
 
-    if sample_size > df.filter(df["Covid-19"] == 1).count():
-        return df
+    state, infection_day = df["Covid-19"], df["Day"]
+    infected = state == 1
+    chance = keyed_rand(seed, TRANSITION, day)
 
-    df = df.withColumn("hosp_chance", F.rand())
-    df = df.withColumn(
-        "Covid-19",
-        F.when((df["Covid-19"] == 1) & (df["hosp_chance"] < sample_fraction),
-               115).otherwise(df["Covid-19"]))
-    df = df.drop("hosp_chance")
-    return df
+    # People hospitalized today are cured at once after 21 days, like the
+    # cure step used to do after the hospitalize step
+    new_state = (F.when(infected & (chance < kill_fraction), 666).when(
+        infected & (chance < kill_fraction + hosp_fraction),
+        F.when(infection_day < day - 21, 7).otherwise(115)).when(
+            infected & (infection_day < day - 10),
+            7).when((state == 115) & (infection_day < day - 21),
+                    7).otherwise(state))
+    return df.withColumn("Covid-19", new_state)
 
 
-def cure(df, day):
+def random_walk(df, day, x_limit, y_limit, seed):
     """
-    Cure people after their quarantine is finished
+    Talk random steps in the world
+    The same people stop moving as in Population.walk. Steps are drawn with
+    native column expressions in the same projection that updates the
+    movers, so no row goes through a Python worker.
     Keyword arguments:
-    df -- covid dataframe [X,Y,Covid-19,Day]
+    df -- covid dataframe [X,Y,Covid-19,Day,is_mover]
+    day -- current day
+    x_limit -- max range on X-axis
+    y_limit -- max range on Y-axis
+    seed -- seed of the simulation
+    """
+
+    is_mover = df["is_mover"] & ~df["Covid-19"].isin(115, 666)
+    step_x = 1 + (x_limit / 3 - 1) * keyed_rand(seed, WALK_X, day)
+    step_y = 1 + (y_limit / 3 - 1) * keyed_rand(seed, WALK_Y, day)
+    columns = {
+        "X": F.when(is_mover, (df["X"] + step_x) % x_limit).otherwise(df["X"]),
+        "Y": F.when(is_mover, (df["Y"] + step_y) % y_limit).otherwise(df["Y"]),
+        "is_mover": is_mover,
+    }
+    return df.select(
+        [columns[name].alias(name) if name in columns else df[name]
+         for name in df.columns])
+
+
+def simulate_next_day(covid_df, day, x_limit, y_limit, counts, seed):
+    """
+    Simulates the next day given current day data
+    Keyword arguments:
+    covid_df -- covid dataframe [X,Y,Covid-19,Day,is_mover]
     day -- current day
+    counts -- compartment counts of the current day
+    seed -- seed of the simulation
     """
 
     assert isinstance(day, int)
 
-    df = df.withColumn(
-        "Covid-19",
-        F.when((df["Day"] < day - 10) & (df["Covid-19"] == 1),
-               7).otherwise(df["Covid-19"]))
-    df = df.withColumn(
-        "Covid-19",
-        F.when((df["Day"] < day - 21) & (df["Covid-19"] == 115),
-               7).otherwise(df["Covid-19"]))
-    return df
+    day += 1
+    # Position and state before the day, the export sends the changes only
+    covid_df = covid_df.withColumn("yesterday", F.struct("X", "Y", "Covid-19"))
+    covid_df = transition(covid_df, day, counts, seed)
+    covid_df = random_walk(covid_df, day, x_limit, y_limit, seed)
+
+    return covid_df, day
 
 
-def random_walk(df, movers_list, x_limit, y_limit):
+def grid_shape(dist_limit, x_limit, y_limit):
     """
-    Talk random steps in the world
+    Number of grid cells along the X-axis and the Y-axis
     Keyword arguments:
-    df -- covid dataframe [X,Y,Covid-19,Day]
-    movers_list -- list of people who are moving in the world
+    dist_limit -- min width of the cells
     x_limit -- max range on X-axis
     y_limit -- max range on Y-axis
     """
+    assert dist_limit > 0
 
-    result = df.collect()
-    for i in movers_list:
-        if (result[i]['Covid-19'] == 115) or (result[i]['Covid-19'] == 666):
-            movers_list.remove(i)
+    return max(1, int(x_limit // dist_limit)), max(1,
+                                                   int(y_limit // dist_limit))
 
-    def get_random(x):
-        return random.uniform(1, x / 3)
 
-    udf_get_random = F.udf(get_random)
-    df = df.withColumn(
-        "X",
-        F.when(df["pid"].isin(movers_list),
-               (df["X"] + udf_get_random(df["X"])) % x_limit).otherwise(
-            df["X"]))
-    df = df.withColumn(
-        "Y",
-        F.when(df["pid"].isin(movers_list),
-               (df["Y"] + udf_get_random(df["Y"])) % y_limit).otherwise(
-            df["Y"]))
+def cell_columns(df, dist_limit, x_limit, y_limit):
+    """
+    Add the grid cell of every person as the columns cx and cy
+    The grid is the one of contacts.cell_index.
+    Keyword arguments:
+    df -- covid dataframe [pid,X,Y,Covid-19,Day]
+    dist_limit -- safe social distance limit
+    x_limit -- max range on X-axis
+    y_limit -- max range on Y-axis
+    """
+    nx, ny = grid_shape(dist_limit, x_limit, y_limit)
+    df = df.withColumn("cx", F.floor(df["X"] / (x_limit / nx)).cast("int"))
+    df = df.withColumn("cy", F.floor(df["Y"] / (y_limit / ny)).cast("int"))
+    return df
+
+
+def skewed_cells(covid_df, dist_limit, x_limit, y_limit, partitions, seed,
+                 fraction=0.05):
+    """
+    Number of salts of the cells holding more than a fair share of people
+    The cell counts are estimated from a sample of the population, a cell
+    gets one salt for every fair share of the join input it holds, where a
+    fair share is the population over the number of shuffle partitions.
+    Returns cell id -> number of salts for the hot cells only.
+    Keyword arguments:
+    covid_df -- covid dataframe [pid,X,Y,Covid-19,Day]
+    dist_limit -- safe social distance limit
+    x_limit -- max range on X-axis
+    y_limit -- max range on Y-axis
+    partitions -- number of shuffle partitions of the join
+    seed -- seed of the sample
+    fraction -- share of the population sampled (default: 0.05)
+    """
 
-    # df.filter(df['pid'].isin(movers_list)).show()
-    return df, movers_list
+    _, ny = grid_shape(dist_limit, x_limit, y_limit)
+    people = cell_columns(covid_df.select("X", "Y"), dist_limit, x_limit,
+                          y_limit)
+    counts = people.sample(False, fraction,
+                           seed).groupBy("cx", "cy").count().collect()
 
+    fair_share = max(1.0, sum(row["count"] for row in counts) / partitions)
+    salts = {}
+    for row in counts:
+        n_salts = min(partitions, math.ceil(row["count"] / fair_share))
+        if n_salts > 1:
+            salts[row["cx"] * ny + row["cy"]] = n_salts
+    return salts
 
-def simulate_next_day(covid_df, stats_df, day, movers_list, x_limit, y_limit):
+
+def contact_pairs(covid_df, dist_limit, x_limit, y_limit, salts=None):
     """
-    Simulates the next day given current day data
+    Find every (infected, healthy) pair of people closer than dist_limit
+    Infected people are copied into their 3x3 cell neighbourhood and
+    equi-joined with the healthy people on the cell, so the shuffle grows
+    with N times the local density instead of N^2. Distances are computed
+    with native column expressions.
+    The healthy people of hot cells are spread over the salts of the cell
+    and the infected ones joining the cell are copied to every salt, so a
+    dense cell is split over several tasks.
     Keyword arguments:
-    covid_df -- covid dataframe [X,Y,Covid-19,Day]
-    stats_df -- stats dataframe [Healthy,Covid-19(+),Hospitalized,Cured,Dead]
-    day -- current day
+    covid_df -- covid dataframe [pid,X,Y,Covid-19,Day]
+    dist_limit -- safe social distance limit
+    x_limit -- max range on X-axis
+    y_limit -- max range on Y-axis
+    salts -- cell id -> number of salts of the hot cells (default: none)
     """
 
-    assert isinstance(day, int)
+    people = cell_columns(covid_df.select("pid", "X", "Y", "Covid-19"),
+                          dist_limit, x_limit, y_limit)
+    offsets = F.array([F.lit(offset) for offset in (-1, 0, 1)])
+
+    infected = people.filter(people["Covid-19"] == 1)
+    infected = infected.withColumn("ox", F.explode(offsets))
+    infected = infected.withColumn("oy", F.explode(offsets))
+    infected = infected.select(
+        infected["pid"].alias("pid1"),
+        infected["X"].alias("X1"),
+        infected["Y"].alias("Y1"),
+        (infected["cx"] + infected["ox"]).alias("cx"),
+        (infected["cy"] + infected["oy"]).alias("cy"),
+    )
 
-    day += 1
-    covid_df = kill(covid_df)
-    covid_df = hospitalize(covid_df)
-    covid_df = cure(covid_df, day)
-    covid_df, movers_list = random_walk(covid_df, movers_list, x_limit,
-                                        y_limit)
+    healthy = people.filter(people["Covid-19"] == 0)
+    healthy = healthy.select(
+        healthy["pid"].alias("pid2"),
+        healthy["X"].alias("X2"),
+        healthy["Y"].alias("Y2"),
+        "cx",
+        "cy",
+    )
+
+    keys = ["cx", "cy"]
+    if salts:
+        _, ny = grid_shape(dist_limit, x_limit, y_limit)
+        salt_map = F.create_map(
+            [F.lit(x) for item in salts.items() for x in item])
+
+        def n_salts(df):
+            return F.coalesce(salt_map[df["cx"] * ny + df["cy"]], F.lit(1))
 
-    return covid_df, stats_df, day, movers_list
+        infected = infected.withColumn(
+            "salt", F.explode(F.sequence(F.lit(0),
+                                         n_salts(infected) - 1)))
+        healthy = healthy.withColumn("salt", healthy["pid2"] % n_salts(healthy))
+        keys.append("salt")
 
+    pairs = infected.join(healthy, keys)
+    return pairs.filter(
+        F.sqrt((pairs["X1"] - pairs["X2"]) * (pairs["X1"] - pairs["X2"]) +
+               (pairs["Y1"] - pairs["Y2"]) *
+               (pairs["Y1"] - pairs["Y2"])) < dist_limit)
 
-def interact(covid_df, day, yesterday_patients, dist_limit):
+
+def tile_contacts(covid_df, dist_limit, x_limit, y_limit, tile_size):
+    """
+    Find the healthy people closer than dist_limit to an infected one, tile
+    by tile with the local NumPy kernel
+    The world is cut into tiles at least tile_size wide. Every healthy
+    person goes to its own tile and every infected one to its own tile and
+    to the neighbouring tiles within dist_limit, the halo. Each tile then
+    runs contacts.contact_pairs on its rows as a pandas grouped map over
+    Arrow, so only the tiles are shuffled instead of the 3x3 cell copies.
+    contacts.py has to reach the executors, see SIMULATOR_MODULES.
+    Keyword arguments:
+    covid_df -- covid dataframe [pid,X,Y,Covid-19,Day]
+    dist_limit -- safe social distance limit
+    x_limit -- max range on X-axis
+    y_limit -- max range on Y-axis
+    tile_size -- min width of the tiles, at least dist_limit
+    """
+    assert tile_size >= dist_limit
+
+    nx, ny = grid_shape(tile_size, x_limit, y_limit)
+    width, height = x_limit / nx, y_limit / ny
+
+    people = cell_columns(covid_df.select("pid", "X", "Y", "Covid-19"),
+                          tile_size, x_limit, y_limit)
+    offsets = F.array([F.lit(offset) for offset in (-1, 0, 1)])
+
+    healthy = people.filter(people["Covid-19"] == 0)
+    healthy = healthy.withColumn("tile", healthy["cx"] * ny + healthy["cy"])
+
+    # Copy the infected into every tile their reach crosses into
+    infected = people.filter(people["Covid-19"] == 1)
+    infected = infected.withColumn("ox", F.explode(offsets))
+    infected = infected.withColumn("oy", F.explode(offsets))
+    tx, ty = infected["cx"] + infected["ox"], infected["cy"] + infected["oy"]
+    infected = infected.filter(
+        (F.floor((infected["X"] + infected["ox"] * dist_limit) / width) == tx)
+        & (F.floor((infected["Y"] + infected["oy"] * dist_limit) / height) == ty)
+        & tx.between(0, nx - 1) & ty.between(0, ny - 1))
+    infected = infected.withColumn("tile", tx * ny + ty)
+
+    columns = ["tile", "pid", "X", "Y", "Covid-19"]
+    tiles = healthy.select(columns).union(infected.select(columns))
+
+    def tile_kernel(tile):
+        from contacts import contact_pairs as local_contact_pairs
+
+        state = tile["Covid-19"].values
+        _, persons = local_contact_pairs(tile["X"].values,
+                                         tile["Y"].values,
+                                         dist_limit,
+                                         x_limit,
+                                         y_limit,
+                                         sources=state == 1,
+                                         targets=state == 0)
+        return pd.DataFrame({"pid": np.unique(tile["pid"].values[persons])})
+
+    grouped = tiles.groupBy("tile")
+    if hasattr(grouped, "applyInPandas"):
+        return grouped.applyInPandas(tile_kernel, schema="pid long")
+    return grouped.apply(
+        F.pandas_udf(tile_kernel, "pid long", F.PandasUDFType.GROUPED_MAP))
+
+
+def interact(covid_df,
+             day,
+             dist_limit,
+             x_limit,
+             y_limit,
+             tile_size=None,
+             salts=None):
     """
     Infect people who interact with oneanother
     Keyword arguments:
     df -- covid dataframe [X,Y,Covid-19,Day]
     day -- current day
+    dist_limit -- safe social distance limit
+    x_limit -- max range on X-axis
+    y_limit -- max range on Y-axis
+    tile_size -- run the local kernel on tiles of this size (default: join)
+    salts -- cell id -> number of salts of the hot cells of the join
     """
     assert isinstance(day, int)
 
-    distance_pairs = (covid_df["pid", "X", "Y", "Covid-19"].crossJoin(
-        covid_df["pid", "X", "Y",
-                 "Covid-19"]).toDF("pid1", "X1", "Y1", "Covid19_1", "pid2",
-                                   "X2", "Y2", "Covid19_2"))
-
-    distance_pairs = distance_pairs.filter(
-        distance_pairs.pid1 != distance_pairs.pid2)
+    if tile_size:
+        persons_to_infect = tile_contacts(covid_df, dist_limit, x_limit,
+                                          y_limit, tile_size)
+    else:
+        distance_pairs = contact_pairs(covid_df, dist_limit, x_limit, y_limit,
+                                       salts)
+        persons_to_infect = distance_pairs.select(
+            distance_pairs["pid2"].alias("pid"))
+    return infect(covid_df, day, persons_to_infect)
 
-    def get_distance(x1, y1, x2, y2):
-        return math.sqrt((x1 - x2) ** 2 + (y1 - y2) ** 2)
 
-    udf_get_distance = F.udf(get_distance)
+def plan_depth(df):
+    """
+    Depth of the logical plan of a dataframe
+    Keyword arguments:
+    df -- spark dataframe
+    """
 
-    distance_pairs = distance_pairs.withColumn(
-        "EUCLIDEAN_DISTANCE",
-        udf_get_distance(distance_pairs.X1, distance_pairs.Y1,
-                         distance_pairs.X2, distance_pairs.Y2),
-    )
+    plan = df._jdf.queryExecution().logical().treeString()
+    return max((len(line) - len(line.lstrip(" :+-|"))) // 3 + 1
+               for line in plan.splitlines() if line.strip())
 
-    distance_pairs = distance_pairs.filter(
-        (distance_pairs["EUCLIDEAN_DISTANCE"] < dist_limit)
-        & (((distance_pairs["Covid19_1"] == 1) &
-            (distance_pairs["Covid19_2"] == 0))
-           | ((distance_pairs["Covid19_1"] == 0) &
-              (distance_pairs["Covid19_2"] == 1))))
 
-    persons_to_infect = distance_pairs.select("pid1").union(
-        distance_pairs.select("pid2")).distinct()
-    persons_to_infect = [row.pid1 for row in persons_to_infect.collect()]
+def truncate_lineage(df, day, checkpoint_every, reliable=False):
+    """
+    Cut the lineage of a dataframe every checkpoint_every days
+    Every simulated day stacks more projections and joins onto the plan, so
+    planning and execution get slower every day unless the plan is cut.
+    Local checkpoints keep the data on the executors, reliable ones write
+    it to the checkpoint directory of the SparkContext.
+    Keyword arguments:
+    df -- spark dataframe
+    day -- current day
+    checkpoint_every -- number of days between checkpoints, 0 to never cut
+    reliable -- checkpoint to the checkpoint directory (default: False)
+    """
 
-    covid_df = covid_df.withColumn(
-        "Covid-19",
-        F.when(covid_df["pid"].isin(persons_to_infect),
-               1).otherwise(covid_df["Covid-19"]))
-    covid_df = covid_df.withColumn(
-        "Day",
-        F.when(covid_df["pid"].isin(persons_to_infect),
-               day).otherwise(covid_df["Day"]))
-    return covid_df
+    if not checkpoint_every or day % checkpoint_every != 0:
+        return df
+    if reliable:
+        return df.checkpoint(eager=True)
+    return df.localCheckpoint(eager=True)
 
 
 def get_covid_df_plt_color(df):
@@ -622,7 +796,12 @@ def run_simulation(N,
                    motion_factor=0.1,
                    SHOW_PLOT_FLAG=False,
                    SAVE_PLOT_FLAG=False,
-                   simulation_id="sim_id_random"):  ## SIMULATION PARAMETERS
+                   simulation_id="sim_id_random",
+                   checkpoint_every=5,
+                   checkpoint_dir=None,
+                   seed=None,
+                   tile_size=None,
+                   rebalance_every=None):  ## SIMULATION PARAMETERS
     assert N is not None
     assert x_limit is not None
     assert y_limit is not None
@@ -632,91 +811,129 @@ def run_simulation(N,
     dist_limit = float(dist_limit)
     sc = SparkContext()
     sqlContext = SQLContext(sc)
+    if checkpoint_dir:
+        sc.setCheckpointDir(checkpoint_dir)
+    # Ship the modules of the simulator to the executors when running from a
+    # checkout, on EMR they come with --py-files simulator_modules.zip
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    for module in SIMULATOR_MODULES:
+        if os.path.exists(os.path.join(app_dir, module)):
+            sc.addPyFile(os.path.join(app_dir, module))
 
     ## SIMULATION PARAMETERS
-    MOTION_FACTOR = float(motion_factor) * N
+    if seed is None:
+        seed = random.randrange(2**31)
+    print(f"Seed: {seed}")
     day = 0
 
     status_type = {"Student": 0.1, "Working": 0.7, "Child": 0.1, "Old": 0.1}
 
-    covid_df, stats_df, movers_list = initalize_simulation_dataframes(
-        N, x_limit, y_limit, status_type, motion_factor=MOTION_FACTOR)
+    covid_df, stats = initalize_simulation_dataframes(
+        sqlContext,
+        N,
+        x_limit,
+        y_limit,
+        status_type,
+        seed,
+        motion_factor=motion_factor)
     print(f"covid_df: {covid_df}\n")
-    print(f"stats_df: {stats_df}\n")
-    print(f"movers_list: {movers_list}\n")
 
-    covid_df = sqlContext.createDataFrame(covid_df)
+    # Split the cells crowded enough to hold up the contact join, the hot
+    # cells are sampled again as the movers shift the density
+    partitions = int(sqlContext.getConf("spark.sql.shuffle.partitions", "200"))
+    salts = None
+    if rebalance_every:
+        salts = skewed_cells(covid_df, dist_limit, x_limit, y_limit,
+                             partitions, seed)
+        print(f"Hot cells: {salts}")
 
     initial_working_hours = get_working_hours(covid_df)
 
     ## Start the simulation by infecting a random person
-    random_person = random.randrange(N)
-    covid_df = infect(covid_df, day, random_person)
+    random_person = random.Random(seed).randrange(N)
+    covid_df = infect(covid_df,
+                      day,
+                      covid_df.filter(covid_df["pid"] == random_person),
+                      broadcast=True)
     fig, axs = plt.subplots(3)
     fig.suptitle("Covid-19 Epidemic Sample Model", fontsize=16)
     # plot_day(covid_df.toPandas(), fig, axs, stats_df, day, movers_list, show=SHOW_PLOT_FLAG, savefig=SAVE_PLOT_FLAG)
 
     ## Plot the static graph
     print("-" * 20)
-    covid_df, stats_df = update_stats_for_day(sqlContext, simulation_id,
-                                              covid_df, stats_df, day,
-                                              initial_working_hours)
-    # Now we have some data in stats_df, convert into spark df
-    stats_df = sqlContext.createDataFrame(stats_df)
+    covid_df, stats = update_stats_for_day(covid_df, stats, day,
+                                           initial_working_hours)
 
     covid_df = update_working_hours(covid_df)
-    yesterday_patients = list(covid_df.toPandas()["Covid-19"])
-    covid_df = covid_df.withColumn("Covid-19",
-                                   covid_df["Covid-19"].cast("int"))
-    covid_df, stats_df, day, movers_list = simulate_next_day(
-        covid_df, stats_df, day, movers_list, x_limit, y_limit)
-    covid_df = interact(covid_df, day, yesterday_patients, dist_limit)
+    covid_df, day = simulate_next_day(covid_df, day, x_limit, y_limit,
+                                      stats.counts[day], seed)
+    covid_df = interact(covid_df, day, dist_limit, x_limit, y_limit,
+                        tile_size, salts)
 
     ## Day 1
-    Elastic.load_sim_data(covid_df.toPandas(), stats_df.toPandas())
+    # Days are uploaded in the background while the next ones run, the day
+    # is persisted first so the export and the stats share one computation
+    covid_df = covid_df.persist(StorageLevel.MEMORY_AND_DISK)
+    exporter = AsyncExport(DeltaExport(simulation_id))
+    exporter.export(day, covid_df, stats.to_dataframe(simulation_id))
     # plot_day(covid_df.toPandas(), fig, axs, stats_df.toPandas(), day, movers_list, show=SHOW_PLOT_FLAG,
     #          savefig=SAVE_PLOT_FLAG)
-    covid_df, stats_df = update_stats_for_day(sqlContext, simulation_id,
-                                              covid_df, stats_df, day,
-                                              initial_working_hours)
+    covid_df, stats = update_stats_for_day(covid_df, stats, day,
+                                           initial_working_hours)
 
     count_sames = 0
-    healthy = stats_df.select("Healthy").collect()[-1].Healthy
+    healthy = stats.healthy(day)
 
-    while healthy > 0 and day < 20:
-        if list(stats_df.toPandas().loc[day]) == list(
-                stats_df.toPandas().loc[day - 1]):
+    # Keep the dataframe of the day cached until the next day is computed
+    cached = covid_df
+    while healthy > 0 and day < MAX_DAYS:
+        start = time.time()
+        if stats.unchanged(day):
             count_sames += 1
             if count_sames > 8:
                 break
         else:
             count_sames = 0
-
-        yesterday_patients = list(covid_df.toPandas()["Covid-19"])
-        covid_df, stats_df, day, movers_list = simulate_next_day(
-            covid_df, stats_df, day, movers_list, x_limit, y_limit)
-        covid_df = interact(covid_df, day, yesterday_patients, dist_limit)
+        if rebalance_every and day % rebalance_every == 0:
+            salts = skewed_cells(covid_df, dist_limit, x_limit, y_limit,
+                                 partitions, seed + day)
+            print(f"Hot cells: {salts}")
+
+        covid_df, day = simulate_next_day(covid_df, day, x_limit, y_limit,
+                                          stats.counts[day], seed)
+        covid_df = interact(covid_df, day, dist_limit, x_limit, y_limit,
+                            tile_size, salts)
         covid_df = update_working_hours(covid_df)
-        working_hours = get_working_hours(covid_df)
-        Elastic.load_sim_data(covid_df.toPandas(), stats_df.toPandas())
+
+        covid_df = truncate_lineage(covid_df, day, checkpoint_every,
+                                    bool(checkpoint_dir))
+        covid_df = covid_df.persist(StorageLevel.MEMORY_AND_DISK)
+        exporter.export(day, covid_df, stats.to_dataframe(simulation_id))
         # plot_day(covid_df.toPandas(), fig, axs, stats_df.toPandas(), day, movers_list, show=SHOW_PLOT_FLAG,
         #          savefig=SAVE_PLOT_FLAG)
-        covid_df, stats_df = update_stats_for_day(sqlContext, simulation_id,
-                                                  covid_df, stats_df, day,
-                                                  initial_working_hours)
+        covid_df, stats = update_stats_for_day(covid_df, stats, day,
+                                               initial_working_hours)
+
+        healthy = stats.healthy(day)
+        # Yesterday stays cached until its export is sent
+        if cached is not None:
+            exporter.call_after(cached.unpersist)
+        cached = covid_df
 
-        healthy = stats_df.select("Healthy").collect()[-1].Healthy
         print(31 * "-")
         print("Day:", day)
         print("----------------")
-        print(f"Stats DF :")
-        stats_df.show()
-        print(f"Total Working Hours: {working_hours}")
+        print(f"Stats : {stats.counts[day]}")
+        print(f"Working Hours: {stats.work[day]:.2f}%")
+        print(f"Plan depth: {plan_depth(covid_df)}")
+        print(f"Export queue: {exporter.depth}, "
+              f"blocked: {exporter.blocked:.2f}s")
+        print(f"Day time: {time.time() - start:.2f}s")
 
-        # stats_df.cache()
-        # covid_df.cache()
-        # sqlContext.clearCache()
-        # sqlContext.clearCache()
+    exporter.close()
+    if cached is not None:
+        cached.unpersist()
+    return stats.to_dataframe(simulation_id)
 
 
 if __name__ == "__main__":
@@ -773,9 +990,54 @@ if __name__ == "__main__":
                         default="False",
                         help="Saves plot on the disk")
 
+    parser.add_argument(
+        "-checkpoint_every",
+        action="store",
+        dest="checkpoint_every",
+        type=int,
+        default=5,
+        help="Days between cuts of the query plan lineage, 0 to never cut")
+    parser.add_argument(
+        "-checkpoint_dir",
+        action="store",
+        dest="checkpoint_dir",
+        default=None,
+        help="Reliable checkpoint directory (e.g. on HDFS or S3), "
+        "checkpoints stay on the executors by default")
+
+    parser.add_argument("-seed",
+                        action="store",
+                        dest="seed",
+                        type=int,
+                        default=None,
+                        help="Seed of the random numbers, random by default")
+
+    parser.add_argument(
+        "-tile_size",
+        action="store",
+        dest="tile_size",
+        type=float,
+        default=None,
+        help="Find contacts with the local kernel on tiles of this size")
+
+    parser.add_argument(
+        "-rebalance_every",
+        action="store",
+        dest="rebalance_every",
+        type=int,
+        default=None,
+        help="Split the crowded cells of the contact join, sampled again "
+        "every given number of days")
+
     args = parser.parse_args()
     run_simulation(N=args.N,
                    x_limit=args.x_limit,
                    y_limit=args.y_limit,
                    dist_limit=args.dist_limit,
-                   simulation_id=args.simID)
+                   motion_factor=args.mov_rate,
+                   simulation_id=args.simID,
+                   checkpoint_every=args.checkpoint_every,
+                   checkpoint_dir=args.checkpoint_dir,
+                   seed=args.seed,
+                   tile_size=args.tile_size,
+                   rebalance_every=args.rebalance_every)
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+from population import COMPARTMENTS, HEALTHY
+
+STATS_COLUMNS = (
+    'simulationID,Day,Healthy,Covid-19(+),Hospitalized,Cured,Dead,Work'.split(
+        ','))
+
+# Days after which a simulation stops
+MAX_DAYS = 100
+
+
+class StatsBuffer:
+    """
+    Preallocated daily time series of the simulation statistics
+
+    Every day is written in place into typed arrays sized for the whole
+    run; a stats dataframe is only built when it is exported. With
+    replicas every day holds one row of stats per replica.
+    """
+
+    def __init__(self, max_days=MAX_DAYS, replicas=None):
+        """
+        Keyword arguments:
+        max_days -- last day the simulation can reach (default: 100)
+        replicas -- number of replicas of the population (default: None)
+        """
+
+        assert isinstance(max_days, int)
+        assert replicas is None or isinstance(replicas, int)
+
+        shape = (max_days + 1, ) if replicas is None else (max_days + 1,
+                                                           replicas)
+        self.counts = np.zeros(shape + (len(COMPARTMENTS), ), dtype=np.int64)
+        self.work = np.zeros(shape, dtype=np.float64)
+        self.days = 0
+
+    def __len__(self):
+        return self.days
+
+    def record(self, day, population, initial_working_hours):
+        """
+        Store the stats of the population for the given day
+
+        Keyword arguments:
+        day -- current day
+        population -- population store
+        initial_working_hours -- working hours before the epidemic
+        """
+
+        self.store(
+            day,
+            np.stack([population.counts[code] for code in COMPARTMENTS],
+                     axis=-1),
+            (population.total_working_hours / initial_working_hours) * 100)
+
+    def store(self, day, counts, work):
+        """
+        Store already aggregated stats for the given day
+
+        Keyword arguments:
+        day -- current day
+        counts -- number of people in every compartment, in COMPARTMENTS order
+        work -- working hours in % of the hours before the epidemic
+        """
+
+        self.counts[day] = counts
+        self.work[day] = work
+        self.days = max(self.days, day + 1)
+
+    def healthy(self, day):
+        """Number of healthy people on the given day"""
+        return self.counts[day, ..., COMPARTMENTS.index(HEALTHY)]
+
+    def unchanged(self, day):
+        """True if no compartment changed since the day before"""
+        return day > 0 and np.all(self.counts[day] == self.counts[day - 1],
+                                  axis=-1)
+
+    def to_dataframe(self, simulation_id):
+        """
+        Convert the recorded days to a stats dataframe
+        [simulationID,Day,Healthy,Covid-19(+),Hospitalized,Cured,Dead,Work]
+        """
+
+        assert self.counts.ndim == 2
+
+        days = self.days
+        stats_df = pd.DataFrame(self.counts[:days], columns=STATS_COLUMNS[2:7])
+        stats_df.insert(0, 'simulationID', simulation_id)
+        stats_df.insert(1, 'Day', np.arange(days))
+        stats_df['Work'] = self.work[:days]
+        return stats_df
@@ -0,0 +1,208 @@
+import itertools
+import os
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import argparse
+
+from simulator import run_simulation
+
+
+def parameter_grid(grid, repeats=1):
+    """
+    Expand a parameter grid into the list of runs
+
+    Keyword arguments:
+    grid -- run_simulation keyword argument -> list of values
+    repeats -- number of runs of every grid point (default: 1)
+    """
+
+    names = sorted(grid)
+    runs = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        for repeat in range(repeats):
+            runs.append(dict(zip(names, values), repeat=repeat))
+    return runs
+
+
+def run_key(params):
+    """Simulation ID identifying a run of the sweep"""
+    return ','.join(f"{name}={params[name]}" for name in sorted(params))
+
+
+def _silence_worker():
+    """Keep the daily progress of the runs off the console"""
+    sys.stdout = open(os.devnull, 'w')
+
+
+def run_seed(params, seed):
+    """
+    Seed of a run derived from the seed of the sweep and the run itself
+
+    Runs get the same random numbers whichever worker runs them and in
+    whichever order.
+
+    Keyword arguments:
+    params -- run_simulation keyword arguments and the repeat number
+    seed -- seed of the sweep, None for unseeded runs
+    """
+
+    if seed is None:
+        return None
+    return [seed, zlib.crc32(run_key(params).encode())]
+
+
+def run_point(params, seed=None):
+    """
+    Simulate one run of the sweep without exporting it to Elasticsearch
+
+    Returns its daily stats with a column for every parameter and the
+    wall time of the run.
+
+    Keyword arguments:
+    params -- run_simulation keyword arguments and the repeat number
+    seed -- seed of the sweep (default: unseeded runs)
+    """
+
+    kwargs = {
+        name: value
+        for name, value in params.items() if name != 'repeat'
+    }
+
+    start = time.time()
+    stats_df = run_simulation(simulation_id=run_key(params),
+                              export=False,
+                              seed=run_seed(params, seed),
+                              **kwargs)
+    seconds = time.time() - start
+
+    for i, name in enumerate(sorted(params)):
+        stats_df.insert(i, name, params[name])
+    stats_df['seconds'] = seconds
+    return stats_df
+
+
+def run_sweep(grid, output, repeats=1, workers=None, seed=None):
+    """
+    Run every point of a parameter grid on a pool of processes
+
+    The daily stats of every run are appended to the output csv as soon as
+    the run finishes. Runs already in the output are skipped, so an
+    interrupted sweep continues where it stopped.
+
+    Keyword arguments:
+    grid -- run_simulation keyword argument -> list of values
+    output -- path of the csv file collecting the results
+    repeats -- number of runs of every grid point (default: 1)
+    workers -- number of processes (default: one per core)
+    seed -- seed of the sweep (default: unseeded runs)
+    """
+
+    runs = parameter_grid(grid, repeats)
+
+    done = set()
+    if os.path.exists(output):
+        done = set(
+            pd.read_csv(output, usecols=['simulationID'],
+                        dtype=str)['simulationID'])
+    pending = [params for params in runs if run_key(params) not in done]
+    print(f"{len(runs) - len(pending)} of {len(runs)} runs already done")
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_silence_worker) as executor:
+        futures = [
+            executor.submit(run_point, params, seed) for params in pending
+        ]
+        for finished, future in enumerate(as_completed(futures), 1):
+            stats_df = future.result()
+            stats_df.to_csv(output,
+                            mode='a',
+                            header=not os.path.exists(output),
+                            index=False)
+            print(f"[{finished}/{len(pending)}] "
+                  f"{stats_df.loc[0, 'simulationID']} "
+                  f"in {stats_df.loc[0, 'seconds']:.2f}s")
+
+    return pd.read_csv(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Arguments for a sweep of COVID-19 Simulations')
+    parser.add_argument('-N',
+                        action="store",
+                        dest="N",
+                        type=int,
+                        nargs='+',
+                        default=[300],
+                        help='Population Sizes to simulate')
+    parser.add_argument('-x_limit',
+                        action="store",
+                        dest="x_limit",
+                        type=int,
+                        nargs='+',
+                        default=[30],
+                        help='X-axis limits of 2D canvas')
+    parser.add_argument('-y_limit',
+                        action="store",
+                        dest="y_limit",
+                        type=int,
+                        nargs='+',
+                        default=[30],
+                        help='Y-axis limits of 2D canvas')
+    parser.add_argument('-dist_thres',
+                        action="store",
+                        dest="dist_limit",
+                        type=float,
+                        nargs='+',
+                        default=[1.5],
+                        help='Distance thresholds to infect another person')
+    parser.add_argument('-mov_rate',
+                        action="store",
+                        dest="mov_rate",
+                        type=float,
+                        nargs='+',
+                        default=[0.15],
+                        help='Rates of infection spread')
+    parser.add_argument('-repeats',
+                        action="store",
+                        dest="repeats",
+                        type=int,
+                        default=1,
+                        help='Number of runs of every parameter set')
+    parser.add_argument('-workers',
+                        action="store",
+                        dest="workers",
+                        type=int,
+                        default=None,
+                        help='Number of processes, one per core by default')
+    parser.add_argument('-output',
+                        action="store",
+                        dest="output",
+                        default='sweep.csv',
+                        help='Csv file collecting the results')
+    parser.add_argument('-seed',
+                        action="store",
+                        dest="seed",
+                        type=int,
+                        default=None,
+                        help='Seed of the sweep, random by default')
+
+    args = parser.parse_args()
+
+    run_sweep(
+        {
+            'N': args.N,
+            'x_limit': args.x_limit,
+            'y_limit': args.y_limit,
+            'dist_limit': args.dist_limit,
+            'motion_factor': args.mov_rate
+        },
+        args.output,
+        repeats=args.repeats,
+        workers=args.workers,
+        seed=args.seed)
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "simulator"))
+
+from contacts import contact_pairs
+
+
+def brute_force_pairs(x, y, dist_limit, sources, targets):
+    pairs = set()
+    for s in np.flatnonzero(sources):
+        for t in np.flatnonzero(targets):
+            dist = np.sqrt((x[s] - x[t])**2 + (y[s] - y[t])**2)
+            if s != t and dist < dist_limit:
+                pairs.add((s, t))
+    return pairs
+
+
+def test_contact_pairs_match_brute_force():
+    rng = np.random.default_rng(7)
+    x, y = rng.uniform(0, 30, 400), rng.uniform(0, 20, 400)
+    sources = rng.random(400) < 0.2
+
+    s, t = contact_pairs(x,
+                         y,
+                         1.5,
+                         30,
+                         20,
+                         sources=sources,
+                         targets=~sources,
+                         chunk_size=16)
+
+    assert set(zip(s, t)) == brute_force_pairs(x, y, 1.5, sources, ~sources)
+    assert len(s) == len(set(zip(s, t)))
+
+
+def test_contact_pairs_small_world():
+    # A grid of a single cell must not report any pair twice
+    x, y = np.array([0.1, 0.5, 2.0]), np.array([0.1, 0.4, 2.0])
+
+    s, t = contact_pairs(x, y, 3.0, 4, 4)
+
+    assert sorted(zip(s, t)) == [(0, 1), (0, 2), (1, 0), (1, 2), (2, 0),
+                                 (2, 1)]
@@ -0,0 +1,173 @@
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "simulator"))
+
+import elastic
+from elastic import Elastic, DeltaExport, AsyncExport
+
+
+class FakeElasticsearch:
+    def __init__(self, **options):
+        self.options = options
+
+
+def test_connect_reuses_one_client_per_process(monkeypatch):
+    monkeypatch.setattr(elastic, "Elasticsearch", FakeElasticsearch)
+    monkeypatch.setattr(Elastic, "cloud_id", "cloud")
+    monkeypatch.setattr(Elastic, "username", "user")
+    monkeypatch.setattr(Elastic, "password", "secret")
+    monkeypatch.setattr(Elastic, "_client", None)
+    monkeypatch.setattr(Elastic, "_client_pid", None)
+    monkeypatch.setattr(os, "getpid", lambda: 1)
+
+    client = Elastic.connect()
+
+    assert Elastic.connect() is client
+    assert client.options["cloud_id"] == "cloud"
+    assert client.options["http_auth"] == ("user", "secret")
+    assert client.options["maxsize"] == Elastic.maxsize
+
+    # A forked process makes its own client
+    monkeypatch.setattr(os, "getpid", lambda: 2)
+    forked = Elastic.connect()
+
+    assert forked is not client
+    assert Elastic.connect() is forked
+
+
+def test_stats_documents():
+    stats_df = pd.DataFrame({
+        "simulationID": ["sim", "sim"],
+        "Day": [0, 1],
+        "Healthy": [9, 7],
+        "Covid-19(+)": [1, 3],
+        "Hospitalized": [0, 0],
+        "Cured": [0, 0],
+        "Dead": [0, 0],
+        "Work": [100.0, 80.0]
+    })
+
+    long_df, eco_df = Elastic.stats_documents(stats_df)
+
+    assert list(long_df.columns) == ["day", "status", "value"]
+    assert len(long_df) == 12
+    assert list(long_df["status"][:6]) == [
+        "Day", "Healthy", "Covid-19(+)", "Hospitalized", "Cured", "Dead"
+    ]
+    assert list(long_df["day"]) == [0] * 6 + [1] * 6
+    assert list(long_df["value"][6:8]) == [1, 7]
+
+    assert list(eco_df["day"]) == [0, 0, 1, 1]
+    assert list(eco_df["type"]) == ["Work", "Threshold"] * 2
+    assert list(eco_df["percentage"]) == [100.0, 50.0, 80.0, 50.0]
+
+
+def test_actions_stream_every_row_in_chunks(monkeypatch):
+    monkeypatch.setattr(Elastic, "chunk_size", 2)
+    data = pd.DataFrame({"X": [0.5, 1.5, 2.5], "Day": [None, 1.0, None]})
+    ids = np.array(["a", "b", "c"])
+
+    actions = list(Elastic.actions(data, "covid_df", ids))
+
+    assert [action["_id"] for action in actions] == ["a", "b", "c"]
+    assert [json.loads(action["_source"]) for action in actions] == [
+        dict(X=0.5, Day=None),
+        dict(X=1.5, Day=1.0),
+        dict(X=2.5, Day=None)
+    ]
+
+
+def stats_row(day, infected):
+    return {
+        "simulationID": "sim",
+        "Day": day,
+        "Healthy": 3 - infected,
+        "Covid-19(+)": infected,
+        "Hospitalized": 0,
+        "Cured": 0,
+        "Dead": 0,
+        "Work": 100.0
+    }
+
+
+def test_delta_export_sends_only_the_changes(monkeypatch):
+    loaded = {}
+    monkeypatch.setattr(
+        Elastic, "load_data",
+        staticmethod(lambda data, index, ids=None: loaded.update(
+            {index: (data, list(ids))})))
+    covid_df = pd.DataFrame({
+        "X": [0.5, 1.5, 2.5],
+        "Y": [0.5, 1.5, 2.5],
+        "Covid-19": [1, 0, 0],
+        "Day": [0.0, None, None],
+        "status": ["Working"] * 3,
+        "working_hours": [40] * 3
+    })
+    stats_df = pd.DataFrame([stats_row(0, 1)])
+    exporter = DeltaExport("sim")
+
+    exporter.export(0, covid_df, stats_df)
+
+    assert loaded["covid_df"][1] == ["sim-0-0", "sim-0-1", "sim-0-2"]
+    assert list(loaded["covid_df"][0]["Covid-19"]) == [
+        "Infected", "Healthy", "Healthy"
+    ]
+    assert loaded["stats_df"][1] == [
+        "sim-0-Day", "sim-0-Healthy", "sim-0-Covid-19(+)",
+        "sim-0-Hospitalized", "sim-0-Cured", "sim-0-Dead"
+    ]
+    assert loaded["eco_df"][1] == ["sim-0-Work", "sim-0-Threshold"]
+
+    covid_df.loc[1, ["Covid-19", "Day"]] = [1, 1.0]
+    covid_df.loc[2, "X"] = 2.75
+    stats_df = pd.DataFrame([stats_row(0, 1), stats_row(1, 2)])
+
+    exporter.export(1, covid_df, stats_df)
+
+    assert loaded["covid_df"][1] == ["sim-1-1", "sim-1-2"]
+    assert list(loaded["covid_df"][0]["pid"]) == [1, 2]
+    assert list(loaded["covid_df"][0]["Covid-19"]) == ["Infected", "Healthy"]
+    assert list(loaded["covid_df"][0]["day"]) == [1, 1]
+    assert loaded["stats_df"][1] == [
+        "sim-1-Day", "sim-1-Healthy", "sim-1-Covid-19(+)",
+        "sim-1-Hospitalized", "sim-1-Cured", "sim-1-Dead"
+    ]
+    assert loaded["eco_df"][1] == ["sim-1-Work", "sim-1-Threshold"]
+
+
+class SlowExport:
+    def __init__(self):
+        self.days = []
+
+    def export(self, day):
+        time.sleep(0.01)
+        self.days.append(day)
+
+
+def test_async_export_sends_every_day_in_order():
+    exporter = AsyncExport(SlowExport(), max_pending=1)
+    for day in range(10):
+        exporter.export(day)
+    exporter.close()
+
+    assert exporter.exporter.days == list(range(10))
+    assert exporter.exports == 10
+    assert exporter.max_depth == 1
+    assert exporter.blocked > 0
+
+
+def test_async_export_raises_writer_errors():
+    exporter = AsyncExport(SlowExport())
+    exporter.export("not a day")
+    exporter.call_after(lambda: 1 / 0)
+
+    with pytest.raises(ZeroDivisionError):
+        exporter.close()
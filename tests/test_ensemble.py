@@ -0,0 +1,60 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "simulator"))
+
+from ensemble import run_ensemble
+from population import Population, STATUS_TYPE, INFECTED
+from rng import RandomStreams
+
+
+def test_replica_counters():
+    streams = RandomStreams(5)
+    population = Population(200, replicas=4, debug=True)
+    population.populate(streams, 10, 10, STATUS_TYPE, 30)
+    population.infect(np.arange(4) * 200 + [3, 50, 100, 150], 0)
+
+    for day in range(1, 30):
+        yesterday_patients = population.state.copy()
+        population.transition(day, streams, 0.05, 0.2)
+        population.walk(streams, day, 10, 10)
+        population.interact(yesterday_patients, day, 1.5, 10, 10, streams)
+        population.check_counters()
+
+    assert np.all(np.count_nonzero(population.mover, axis=1) <= 30)
+    assert np.all(sum(population.counts.values()) == 200)
+
+
+def test_replicas_do_not_meet():
+    population = Population(2, replicas=2)
+    population.state[0, 0] = INFECTED
+    population.recount()
+
+    population.interact(population.state.copy(), 1, 1.0, 10, 10,
+                        RandomStreams(0))
+
+    assert population.state.tolist() == [[INFECTED, INFECTED], [0, 0]]
+
+
+def test_run_ensemble():
+    stats_df, summary_df = run_ensemble(8, 100, 10, 10, 1.5, seed=2)
+
+    assert sorted(set(stats_df["replica"])) == list(range(8))
+    assert set(summary_df["status"]) == {
+        "Healthy", "Covid-19(+)", "Hospitalized", "Cured", "Dead", "Work"
+    }
+    healthy = summary_df[summary_df["status"] == "Healthy"]
+    assert np.all(healthy["q5"] <= healthy["q50"])
+    assert np.all(healthy["q50"] <= healthy["q95"])
+    assert healthy["mean"].iloc[0] == 99
+
+
+def test_replicas_match_batches():
+    stats_df, _ = run_ensemble(4, 100, 10, 10, 1.5, seed=11)
+    first_df, _ = run_ensemble(2, 100, 10, 10, 1.5, seed=11)
+
+    # The first replicas of an ensemble do not depend on the other ones
+    assert first_df.equals(
+        stats_df[stats_df["replica"] < 2].reset_index(drop=True))
@@ -0,0 +1,136 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "simulator"))
+
+from population import Population, HEALTHY, INFECTED, CURED, HOSPITALIZED, DEAD, NO_DAY, STATUS_TYPE
+from rng import RandomStreams
+
+
+def test_to_dataframe():
+    population = Population(3)
+    population.x[:] = [1.0, 2.0, 3.0]
+    population.status_labels = ["Working", "Old"]
+    population.status[:] = [0, 1, 0]
+    population.working_hours[:] = [40, 0, 40]
+    population.state[1], population.day[1] = INFECTED, 4
+
+    covid_df = population.to_dataframe()
+
+    assert list(covid_df.columns) == [
+        "X", "Y", "Covid-19", "Day", "status", "working_hours"
+    ]
+    assert list(covid_df["X"]) == [1.0, 2.0, 3.0]
+    assert list(covid_df["Covid-19"]) == [0, 1, 0]
+    assert covid_df["Day"].isna().tolist() == [True, False, True]
+    assert covid_df.loc[1, "Day"] == 4
+    assert list(covid_df["status"]) == ["Working", "Old", "Working"]
+
+
+def test_movers_list():
+    population = Population(5)
+    population.mover[[1, 3]] = True
+
+    assert population.movers_list == [1, 3]
+    assert np.all(population.day == NO_DAY)
+
+
+def test_walk_moves_only_movers():
+    population = Population(4)
+    population.x[:] = population.y[:] = 5.0
+    population.mover[[0, 1, 2]] = True
+    population.state[1] = HOSPITALIZED
+
+    population.walk(RandomStreams(0), 1, 10, 10)
+
+    assert population.movers_list == [0, 2]
+    assert population.x[0] != 5.0 and population.x[2] != 5.0
+    assert population.x[1] == population.x[3] == 5.0
+    assert np.all((population.x >= 0) & (population.x < 10))
+    assert np.all((population.y >= 0) & (population.y < 10))
+
+
+def test_transition():
+    population = Population(1000)
+    population.state[:400] = INFECTED
+    population.day[:400] = 20
+    population.state[400:600] = HOSPITALIZED
+    population.day[400:500] = 0
+    population.day[500:600] = 20
+    population.recount()
+
+    population.transition(25, RandomStreams(1), 0.01, 0.5)
+
+    state = population.state.copy()
+    # 6 deaths among the infected, half of the others go to hospital
+    assert np.count_nonzero(state[:400] == DEAD) == 6
+    assert np.count_nonzero(state[:400] == HOSPITALIZED) == 197
+    # Hospitalized for more than 21 days
+    assert np.all(state[400:500] == CURED)
+    assert np.all(state[500:600] == HOSPITALIZED)
+    assert np.all(state[600:] == HEALTHY)
+
+    population.transition(31, RandomStreams(1), 0.0, 0.0)
+
+    assert np.all(population.state[:400][state[:400] == INFECTED] == CURED)
+
+
+def test_counters_follow_kernels():
+    rng = np.random.default_rng(3)
+    population = Population(500, debug=True)
+    population.status_hours = np.array([40, 0], dtype=np.int32)
+    population.status[:] = rng.integers(0, 2, 500)
+    population.working_hours[:] = population.status_hours[population.status]
+    population.recount()
+
+    population.infect(rng.integers(0, 500, 300), 0)
+    for day in range(1, 40):
+        population.transition(day, RandomStreams(3), 0.05, 0.2)
+        population.infect(rng.integers(0, 500, 20), day)
+        population.check_counters()
+
+    assert sum(population.counts.values()) == 500
+    assert population.counts[CURED] > 0
+
+
+def test_populate_does_not_depend_on_chunks():
+    population = Population(1000)
+    population.populate(RandomStreams(4), 10, 20, STATUS_TYPE, 150)
+    chunked = Population(1000)
+    chunked.populate(RandomStreams(4), 10, 20, STATUS_TYPE, 150, chunk_size=64)
+
+    assert np.array_equal(population.x, chunked.x)
+    assert np.array_equal(population.status, chunked.status)
+    assert np.array_equal(population.mover, chunked.mover)
+    assert np.count_nonzero(population.mover) == 150
+    assert np.all((population.y >= 0) & (population.y < 20))
+    assert population.total_working_hours == 40 * np.count_nonzero(
+        population.status == population.status_labels.index("Working"))
+
+
+def test_populate_layouts():
+    density = np.zeros((2, 4))
+    density[1, 3] = 1.0
+    population = Population(500)
+    population.populate(RandomStreams(6),
+                        40,
+                        10,
+                        STATUS_TYPE,
+                        0,
+                        density=density)
+
+    # Everybody lives in the only populated cell
+    assert np.all((population.x >= 30) & (population.x < 40))
+    assert np.all((population.y >= 5) & (population.y < 10))
+
+    population.populate(RandomStreams(6),
+                        1000,
+                        1000,
+                        STATUS_TYPE,
+                        0,
+                        clusters=3,
+                        cluster_spread=1.0)
+    # Three tight clusters cover at most two hundreds each
+    assert len(np.unique(np.round(population.x, -2))) <= 6
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "simulator"))
+
+from rng import RandomStreams, WALK_X, CONTACT
+
+
+def test_uniform_is_keyed():
+    streams = RandomStreams(42)
+    key = np.arange(1000)
+    u = streams.uniform(CONTACT, 3, 0, key)
+
+    assert np.all((u >= 0) & (u < 1))
+    assert abs(u.mean() - 0.5) < 0.05
+    # Same numbers in any order, in chunks or from another process
+    order = np.random.default_rng(0).permutation(1000)
+    assert np.array_equal(streams.uniform(CONTACT, 3, 0, key[order]), u[order])
+    assert np.array_equal(
+        np.concatenate([
+            RandomStreams(42).uniform(CONTACT, 3, 0, chunk)
+            for chunk in np.array_split(key, 7)
+        ]), u)
+    # Other phases, days and replicas get other numbers
+    assert not np.array_equal(streams.uniform(WALK_X, 3, 0, key), u)
+    assert not np.array_equal(streams.uniform(CONTACT, 4, 0, key), u)
+    assert not np.array_equal(streams.uniform(CONTACT, 3, 1, key), u)
+
+
+def test_replica_offset():
+    u = RandomStreams(7).uniform(WALK_X, 1, np.array([2, 3]), np.array([5, 5]))
+
+    assert np.array_equal(
+        RandomStreams(7, replica=2).uniform(WALK_X, 1, 0, 5), u[0])
+    assert np.array_equal(
+        RandomStreams(7, replica=3).uniform(WALK_X, 1, 0, 5), u[1])
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "simulator"))
+
+from population import Population
+from stats import StatsBuffer, STATS_COLUMNS
+
+
+def test_stats_buffer():
+    population = Population(10)
+    population.working_hours[:] = 40
+    population.recount()
+    stats = StatsBuffer(max_days=5)
+
+    stats.record(0, population, 400)
+    population.infect(np.array([1, 2]), 1)
+    stats.record(1, population, 400)
+    stats.record(2, population, 400)
+
+    assert len(stats) == 3
+    assert stats.healthy(1) == 8
+    assert not stats.unchanged(1)
+    assert stats.unchanged(2)
+
+    stats_df = stats.to_dataframe("sim")
+    assert list(stats_df.columns) == STATS_COLUMNS
+    assert list(stats_df["Day"]) == [0, 1, 2]
+    assert list(stats_df["Covid-19(+)"]) == [0, 2, 2]
+    assert list(stats_df["Work"]) == [100.0, 80.0, 80.0]
+    assert set(stats_df["simulationID"]) == {"sim"}
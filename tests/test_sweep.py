@@ -0,0 +1,41 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "simulator"))
+
+from sweep import parameter_grid, run_key, run_sweep
+
+
+def test_parameter_grid():
+    runs = parameter_grid({"N": [100, 200], "dist_limit": [1.5]}, repeats=2)
+
+    assert len(runs) == 4
+    assert runs[0] == {"N": 100, "dist_limit": 1.5, "repeat": 0}
+    assert run_key(runs[3]) == "N=200,dist_limit=1.5,repeat=1"
+
+
+def test_run_sweep_skips_finished_runs(tmp_path):
+    output = str(tmp_path / "sweep.csv")
+    grid = {"N": [100], "x_limit": [10], "y_limit": [10], "dist_limit": [1.5]}
+
+    results = run_sweep(grid, output, workers=1)
+    assert results["simulationID"].nunique() == 1
+    assert set(results["N"]) == {100}
+    assert (results["seconds"] > 0).all()
+    days = len(results)
+
+    grid["N"].append(200)
+    results = run_sweep(grid, output, repeats=1, workers=1)
+    assert len(results[results["N"] == 100]) == days
+    assert sorted(results.drop_duplicates("simulationID")["N"]) == [100, 200]
+
+
+def test_seeded_sweep_does_not_depend_on_workers(tmp_path):
+    grid = {"N": [30], "x_limit": [10], "y_limit": [10], "dist_limit": [1.5]}
+    serial = run_sweep(grid, str(tmp_path / "serial.csv"), 2, 1, seed=3)
+    parallel = run_sweep(grid, str(tmp_path / "parallel.csv"), 2, 2, seed=3)
+
+    columns = [column for column in serial.columns if column != "seconds"]
+    serial = serial.sort_values(["repeat", "Day"], ignore_index=True)
+    parallel = parallel.sort_values(["repeat", "Day"], ignore_index=True)
+    assert serial[columns].equals(parallel[columns])